@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Import time benchmark of the yaml4rst CLI
+
+Runs ``yaml4rst --version`` and ``yaml4rst`` for a single file of
+:file:`tests/input_files` in fresh interpreters with ``python -X importtime``
+and reports the summed up import time, the wall time and the modules with the
+highest cumulative import time. The import time of an interpreter which
+imports nothing is reported as baseline.
+
+The results are written as JSON so that runs of different commits can be
+compared, see ``--compare``.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+LOG = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_FILE = os.path.join(REPO_DIR, 'tests', 'input_files', 'debops.apt_install.yml')
+
+# Example: "import time:       412 |       2825 |   yaml4rst.helpers"
+RE_IMPORT_TIME = re.compile(r'^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \| (?P<indent>\s*)(?P<name>\S+)$')
+
+
+def parse_import_times(importtime_output):
+    """Return the cumulative import time in microseconds per module and the total import time.
+
+    The total import time is the sum of the cumulative times of the modules
+    which have been imported at the top level.
+    """
+
+    cumulative_times = {}
+    total_time = 0
+    for line in importtime_output.split('\n'):
+        match = RE_IMPORT_TIME.match(line)
+        if not match:
+            continue
+        cumulative_times[match.group('name')] = int(match.group('cumulative'))
+        if not match.group('indent'):
+            total_time += int(match.group('cumulative'))
+    return cumulative_times, total_time
+
+
+def run_benchmark(name, python_args, repeat, top_count):
+    """Return the fastest timings out of ``repeat`` runs of Python with the given arguments."""
+
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime'] + python_args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            cwd=REPO_DIR,
+        )
+        wall_time = time.perf_counter() - start
+        cumulative_times, total_time = parse_import_times(process.stderr.decode('utf-8'))
+
+        if result is None or total_time < result['import_time']:
+            result = {
+                'name': name,
+                'import_time': total_time,
+                'module_count': len(cumulative_times),
+                'top_modules': sorted(cumulative_times.items(), key=lambda item: item[1], reverse=True)[:top_count],
+                'wall_time': wall_time,
+            }
+        else:
+            result['wall_time'] = min(result['wall_time'], wall_time)
+
+    LOG.info(
+        "%s: import time: %.1f ms, wall time: %.1f ms, %d modules",
+        name, result['import_time'] / 1000, result['wall_time'] * 1000, result['module_count'],
+    )
+    return result
+
+
+def run_suite(repeat, top_count):
+    results = [run_benchmark('baseline', ['-c', 'pass'], repeat, top_count)]
+    results.append(run_benchmark('version', ['-m', 'yaml4rst.cli', '--version'], repeat, top_count))
+    with tempfile.TemporaryDirectory(prefix='yaml4rst-benchmark-') as tmp_dir:
+        results.append(run_benchmark(
+            'single_file',
+            [
+                '-m', 'yaml4rst.cli', '-q',
+                '-e', 'ansible_full_role_name=debops.apt_install',
+                INPUT_FILE,
+                '-o', os.path.join(tmp_dir, 'output.yml'),
+            ],
+            repeat,
+            top_count,
+        ))
+
+    return {
+        'metadata': {
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def print_comparison(baseline, current, output_fh):
+    """Print the import time of the current results relative to the baseline results."""
+
+    baseline_results = {result['name']: result for result in baseline['results']}
+    output_fh.write("{:<20} {:>10} {:>10} {:>7}\n".format('name', 'baseline', 'current', 'ratio'))
+    for result in current['results']:
+        if result['name'] not in baseline_results:
+            continue
+        baseline_time = baseline_results[result['name']]['import_time']
+        current_time = result['import_time']
+        output_fh.write("{:<20} {:>8.1f}ms {:>8.1f}ms {:>7.2f}\n".format(
+            result['name'], baseline_time / 1000, current_time / 1000, current_time / baseline_time,
+        ))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args_parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=5,
+        help="Number of runs per command of which the fastest is reported."
+        " Default: %(default)s.",
+    )
+    args_parser.add_argument(
+        '-t', '--top',
+        type=int,
+        default=10,
+        help="Number of modules with the highest cumulative import time to report."
+        " Default: %(default)s.",
+    )
+    args_parser.add_argument(
+        '-o', '--output-file',
+        help="File to write the JSON results to. Default: STDOUT.",
+    )
+    args_parser.add_argument(
+        '-c', '--compare',
+        help="JSON results of a previous run to compare the import times against.",
+    )
+    args = args_parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    results = run_suite(args.repeat, args.top)
+
+    if args.output_file:
+        with open(args.output_file, 'w', encoding='utf-8') as output_fh:
+            json.dump(results, output_fh, indent=2, sort_keys=True)
+            output_fh.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_fh:
+            print_comparison(json.load(baseline_fh), results, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
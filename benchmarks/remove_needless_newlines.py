@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of removing needless newlines near closing folds
+
+Compares the current implementation of
+:meth:`yaml4rst.reformatter.YamlRstReformatter._remove_needless_newlines` with
+the previous one which deleted empty lines from the list one at a time.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import time
+
+from yaml4rst.reformatter import YamlRstReformatter
+from yaml4rst.tokenizer import tokenize_line
+
+
+def legacy_remove_needless_newlines(lines, wanted_empty_line_count):
+    """Previous implementation which deletes empty lines in place."""
+
+    state = 'before'
+    ind = -1
+    empty_lines_before = []
+    closing_folds = 0
+    while True:
+        ind += 1
+        try:
+            line = lines[ind]
+        except IndexError:
+            break
+
+        if not line.startswith(' '):
+            empty_lines_before = []
+
+        if line == '':
+            empty_lines_before.append(ind)
+        elif tokenize_line(line).fold_change == -1:
+            closing_folds += 1
+            state = 'in'
+
+        if state == 'in':
+            ind += 1
+            for _ in range(ind, len(lines)):
+                if lines[ind] == '':
+                    del lines[ind]
+                elif tokenize_line(lines[ind]).fold_change == -1:
+                    ind += 1
+                    closing_folds += 1
+                else:
+                    state = 'before'
+                    break
+
+            deleted_empty_lines = 0
+            for empty_ind in reversed(empty_lines_before):
+                if closing_folds + len(empty_lines_before) - deleted_empty_lines <= wanted_empty_line_count:
+                    break
+
+                del lines[empty_ind]
+                deleted_empty_lines += 1
+
+            empty_lines_before = []
+            closing_folds = 0
+
+
+def get_synthetic_lines(line_count):
+    """Return about ``line_count`` lines of folded variables with empty lines after each closing fold."""
+
+    lines = ['---', '# Section [[[', '# =======', '']
+    var_ind = 0
+    while len(lines) < line_count:
+        var_ind += 1
+        lines.extend([
+            '# .. envvar:: role_name__var_{} [[['.format(var_ind),
+            '#',
+            '# Description of the variable.',
+            'role_name__var_{}:'.format(var_ind),
+            '  - item',
+            '',
+            '  - item',
+            '                                                                   # ]]]',
+            '',
+            '',
+        ])
+    lines.append('# ]]]')
+    return lines
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args_parser.add_argument(
+        '-l', '--lines',
+        type=int,
+        default=50000,
+        help="Number of lines of the synthetic input."
+        " Default: %(default)s.",
+    )
+    args_parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=3,
+        help="Number of runs of which the fastest is reported."
+        " Default: %(default)s.",
+    )
+    args = args_parser.parse_args()
+
+    logging.getLogger('yaml4rst').setLevel(logging.WARNING)
+
+    input_lines = get_synthetic_lines(args.lines)
+    reformatter = YamlRstReformatter()
+    wanted_empty_line_count = int(reformatter._config['wanted_empty_lines_between_items'])
+
+    def run_legacy():
+        lines = list(input_lines)
+        legacy_remove_needless_newlines(lines, wanted_empty_line_count)
+        return lines
+
+    def run_current():
+        reformatter._lines = list(input_lines)
+        reformatter._remove_needless_newlines()
+        return reformatter._lines
+
+    legacy_time, legacy_lines = measure(run_legacy, args.repeat)
+    current_time, current_lines = measure(run_current, args.repeat)
+
+    if legacy_lines != current_lines:
+        raise SystemExit("Implementations produced different output.")
+
+    print("Input lines: {}, output lines: {}".format(len(input_lines), len(current_lines)))
+    print("legacy:  {:.4f} s".format(legacy_time))
+    print("current: {:.4f} s ({:.1f}x)".format(current_time, legacy_time / current_time))
+
+
+if __name__ == '__main__':
+    main()
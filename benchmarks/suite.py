@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite of yaml4rst
+
+Times :meth:`~yaml4rst.reformatter.YamlRstReformatter.read_file`,
+:meth:`~yaml4rst.reformatter.YamlRstReformatter.reformat` with each of its
+stages and :meth:`~yaml4rst.reformatter.YamlRstReformatter.write_file` for
+every file in :file:`tests/input_files` and for synthetic inputs which repeat
+the variables of :file:`debops.ferm.yml` at different scales.
+
+The results are written as JSON so that runs of different commits can be
+compared, see ``--compare``.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from yaml4rst._meta import __version__
+from yaml4rst import helpers
+from yaml4rst.reformatter import YamlRstReformatter
+
+LOG = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_DIR = os.path.join(REPO_DIR, 'tests', 'input_files')
+
+SYNTHETIC_BASE_FILE = 'debops.ferm.yml'
+SYNTHETIC_HEADER_LINE_COUNT = 10
+
+STAGES = [
+    '_check_folds',
+    '_get_sections_for_lines',
+    '_reformat_legacy_rst_sections',
+    '_reformat_variables',
+    '_sort_section_levels',
+    '_set_section_levels',
+    '_sort_section_levels_equal',
+    '_add_fixmes',
+    '_get_lines_from_sections',
+    '_update_header',
+    '_remove_needless_newlines',
+    '_check_var_names',
+    '_validate_yaml',
+]
+
+
+def get_synthetic_content(scale):
+    """Return the variables of the synthetic base file repeated ``scale`` times under unique names."""
+
+    with open(os.path.join(INPUT_DIR, SYNTHETIC_BASE_FILE), 'r', encoding='utf-8') as input_fh:
+        lines = [line.rstrip() for line in input_fh]
+
+    body_lines = lines[SYNTHETIC_HEADER_LINE_COUNT:]
+    while body_lines and body_lines[-1] == '':
+        body_lines.pop()
+
+    synthetic_lines = lines[:SYNTHETIC_HEADER_LINE_COUNT]
+    for copy_ind in range(scale):
+        if copy_ind > 0:
+            synthetic_lines.append('')
+        synthetic_lines.extend(line.replace('ferm__', 'ferm{}__'.format(copy_ind)) for line in body_lines)
+
+    return '\n'.join(synthetic_lines) + '\n'
+
+
+def time_stages(reformatter, stage_timings):
+    """Wrap the stage methods of the given instance to sum up their wall time in ``stage_timings``.
+
+    Recursive calls of a stage are only counted once. Stages which do not
+    exist in the benchmarked version are skipped.
+    """
+
+    def timed(stage, method, *args, **kwargs):
+        if stage in running_stages:
+            return method(*args, **kwargs)
+
+        running_stages.add(stage)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stage_timings[stage] = stage_timings.get(stage, 0.0) + time.perf_counter() - start
+            running_stages.discard(stage)
+
+    running_stages = set()
+    for stage in STAGES:
+        if not hasattr(reformatter, stage):
+            continue
+        setattr(reformatter, stage, functools.partial(timed, stage, getattr(reformatter, stage)))
+
+
+def run_benchmark(name, input_path, config, repeat):
+    """Return the fastest timings out of ``repeat`` runs for the given input file."""
+
+    result = None
+    with tempfile.TemporaryDirectory(prefix='yaml4rst-benchmark-') as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'output.yml')
+        for _ in range(repeat):
+            reformatter = YamlRstReformatter(config=config)
+            timings = {'stages': {}}
+
+            start = time.perf_counter()
+            reformatter.read_file(input_path)
+            timings['read_file'] = time.perf_counter() - start
+
+            time_stages(reformatter, timings['stages'])
+            start = time.perf_counter()
+            reformatter.reformat()
+            timings['reformat'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            reformatter.write_file(output_path)
+            timings['write_file'] = time.perf_counter() - start
+
+            if result is None:
+                result = {
+                    'name': name,
+                    'input_lines': len(reformatter._original_lines),
+                    'output_lines': len(reformatter._lines),
+                    'timings': timings,
+                }
+            else:
+                best_timings = result['timings']
+                for key in ['read_file', 'reformat', 'write_file']:
+                    best_timings[key] = min(best_timings[key], timings[key])
+                for stage, stage_time in timings['stages'].items():
+                    best_timings['stages'][stage] = min(best_timings['stages'].get(stage, stage_time), stage_time)
+
+    LOG.info("%s: %d lines, reformat: %.4f s", name, result['input_lines'], result['timings']['reformat'])
+    return result
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales, repeat, include_input_files=True):
+    results = []
+
+    if include_input_files:
+        for file_name in sorted(os.listdir(INPUT_DIR)):
+            results.append(run_benchmark(
+                'input_files/{}'.format(file_name),
+                os.path.join(INPUT_DIR, file_name),
+                {'ansible_full_role_name': os.path.splitext(file_name)[0]},
+                repeat,
+            ))
+
+    with tempfile.TemporaryDirectory(prefix='yaml4rst-benchmark-') as tmp_dir:
+        for scale in scales:
+            input_path = os.path.join(tmp_dir, 'synthetic_{}.yml'.format(scale))
+            with open(input_path, 'w', encoding='utf-8') as input_fh:
+                input_fh.write(get_synthetic_content(scale))
+            results.append(run_benchmark(
+                'synthetic/{}x{}'.format(SYNTHETIC_BASE_FILE, scale),
+                input_path,
+                {'ansible_full_role_name': os.path.splitext(SYNTHETIC_BASE_FILE)[0]},
+                repeat,
+            ))
+
+    return {
+        'metadata': {
+            'yaml4rst_version': __version__,
+            'git_revision': get_git_revision(),
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            # Older versions do not report the backend.
+            'yaml_validation_backend': getattr(helpers, 'YAML_VALIDATION_BACKEND', None),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def print_comparison(baseline, current, output_fh):
+    """Print the reformat time of the current results relative to the baseline results."""
+
+    baseline_results = {result['name']: result for result in baseline['results']}
+    output_fh.write("{:<50} {:>10} {:>10} {:>7}\n".format('name', 'baseline', 'current', 'ratio'))
+    for result in current['results']:
+        if result['name'] not in baseline_results:
+            continue
+        baseline_time = baseline_results[result['name']]['timings']['reformat']
+        current_time = result['timings']['reformat']
+        output_fh.write("{:<50} {:>10.4f} {:>10.4f} {:>7.2f}\n".format(
+            result['name'], baseline_time, current_time, current_time / baseline_time,
+        ))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args_parser.add_argument(
+        '-s', '--scales',
+        type=int,
+        nargs='*',
+        default=[1, 10, 100, 1000],
+        help="Sizes of the synthetic inputs as multiples of {}."
+        " Default: %(default)s.".format(SYNTHETIC_BASE_FILE),
+    )
+    args_parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=1,
+        help="Number of runs per input of which the fastest is reported."
+        " Default: %(default)s.",
+    )
+    args_parser.add_argument(
+        '--no-input-files',
+        help="Only run the synthetic benchmarks.",
+        dest='include_input_files',
+        action='store_false',
+        default=True,
+    )
+    args_parser.add_argument(
+        '-o', '--output-file',
+        help="File to write the JSON results to. Default: STDOUT.",
+    )
+    args_parser.add_argument(
+        '-c', '--compare',
+        help="JSON results of a previous run to compare the reformat times against.",
+    )
+    args = args_parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    # Only report progress, not the warnings about the input files.
+    logging.getLogger('yaml4rst').setLevel(logging.ERROR)
+
+    results = run_suite(args.scales, args.repeat, include_input_files=args.include_input_files)
+
+    if args.output_file:
+        with open(args.output_file, 'w', encoding='utf-8') as output_fh:
+            json.dump(results, output_fh, indent=2, sort_keys=True)
+            output_fh.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_fh:
+            print_comparison(json.load(baseline_fh), results, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
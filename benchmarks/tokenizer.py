@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks of the line classifiers of the tokenizer
+
+Times each regular expression of :mod:`yaml4rst.tokenizer` on its own and
+:func:`yaml4rst.tokenizer.tokenize_line` without its cache against the
+previous implementation which searched all patterns in every line. The
+distinct lines of all test files are used as input.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import re
+import time
+
+from yaml4rst import tokenizer
+from yaml4rst.helpers import get_first_match
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_DIRS = [
+    os.path.join(REPO_DIR, 'tests', 'input_files'),
+    os.path.join(REPO_DIR, 'tests', 'output_files'),
+]
+
+LEGACY_RE_FOLD_CLOSE = re.compile(r'^\s*#\s*(?:\.{2})?\s*[\])}]{3}$')
+LEGACY_RE_ENVVAR = re.compile(r'^# \.\. envvar::')
+
+
+def legacy_tokenize_line(line):
+    """Previous implementation which searches all patterns in every line."""
+
+    fold_change = 0
+    fold_name = None
+    fold_open_re = tokenizer._RE_FOLD_OPEN.search(line)
+    if fold_open_re:
+        if fold_open_re.group('fold_level') != '':
+            raise NotImplementedError(
+                "Found explicit fold level. See under known limitations in the docs.")
+        fold_change = +1
+        fold_name = fold_open_re.group('fold_name')
+    elif LEGACY_RE_FOLD_CLOSE.search(line):
+        fold_change = -1
+
+    heading_chars_re = tokenizer.RE_HEADING_CHARS.search(line)
+    heading_re = tokenizer._RE_HEADING.search(line)
+    var_name_re = tokenizer._RE_VAR_NAME.search(line)
+
+    if line == '':
+        kind = tokenizer.KIND_BLANK
+    elif fold_change == +1:
+        kind = tokenizer.KIND_FOLD_OPEN
+    elif fold_change == -1:
+        kind = tokenizer.KIND_FOLD_CLOSE
+    elif heading_chars_re:
+        kind = tokenizer.KIND_HEADING_CHARS
+    elif var_name_re:
+        kind = tokenizer.KIND_VARIABLE
+    elif line.startswith('#'):
+        kind = tokenizer.KIND_COMMENT
+    else:
+        kind = tokenizer.KIND_OTHER
+
+    return tokenizer.LineToken(
+        kind=kind,
+        fold_change=fold_change,
+        fold_name=fold_name,
+        heading_char=heading_chars_re.group('heading_char') if heading_chars_re else None,
+        heading=heading_re.group('heading') if heading_re else None,
+        var_name=var_name_re.group('var_name') if var_name_re else None,
+        envvar=LEGACY_RE_ENVVAR.search(line) is not None,
+    )
+
+
+def get_lines():
+    """Return the distinct lines of all test files."""
+
+    lines = {}
+    for input_dir in INPUT_DIRS:
+        for file_name in sorted(os.listdir(input_dir)):
+            with open(os.path.join(input_dir, file_name), 'r', encoding='utf-8') as input_fh:
+                for line in input_fh:
+                    lines.setdefault(line.rstrip(), None)
+    return list(lines)
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args_parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=3,
+        help="Number of runs of which the fastest is reported."
+        " Default: %(default)s.",
+    )
+    args = args_parser.parse_args()
+
+    lines = get_lines()
+    print("Distinct input lines: {}".format(len(lines)))
+
+    def print_time(name, run_time):
+        print("{:<28} {:>10.0f} ns/line".format(name, run_time / len(lines) * 1e9))
+
+    patterns = [
+        ('legacy _RE_FOLD_CLOSE', LEGACY_RE_FOLD_CLOSE),
+        ('legacy _RE_ENVVAR', LEGACY_RE_ENVVAR),
+    ]
+    pattern_names = [
+        '_RE_FOLD_OPEN', '_RE_FOLD_OPEN_END', '_RE_FOLD_CLOSE', 'RE_HEADING_CHARS', '_RE_HEADING', '_RE_VAR_NAME',
+    ]
+    for pattern_name in pattern_names:
+        patterns.append((pattern_name, getattr(tokenizer, pattern_name)))
+    for pattern_name, pattern in sorted(patterns, key=lambda item: item[0].replace('legacy ', '')):
+        print_time(pattern_name, measure(lambda: [pattern.search(line) for line in lines], args.repeat)[0])
+
+    tokenize_line = tokenizer.tokenize_line.__wrapped__
+    legacy_time, legacy_tokens = measure(lambda: [legacy_tokenize_line(line) for line in lines], args.repeat)
+    current_time, current_tokens = measure(lambda: [tokenize_line(line) for line in lines], args.repeat)
+    if legacy_tokens != current_tokens:
+        raise SystemExit("Implementations produced different tokens.")
+    print_time('legacy tokenize_line', legacy_time)
+    print_time('tokenize_line', current_time)
+    print("tokenize_line speedup: {:.1f}x".format(legacy_time / current_time))
+
+    # Does not match so that all lines are searched.
+    pattern_string = r'^(?P<var_name>\w+):\s*$yaml4rst'
+    compiled_pattern = re.compile(pattern_string)
+    print_time('get_first_match (string)', measure(lambda: get_first_match(pattern_string, lines), args.repeat)[0])
+    print_time('get_first_match (compiled)', measure(lambda: get_first_match(compiled_pattern, lines), args.repeat)[0])
+
+
+if __name__ == '__main__':
+    main()
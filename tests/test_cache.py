@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import unittest.mock
+
+from nose.tools import assert_equal, assert_not_equal
+from testfixtures import tempdir
+
+from yaml4rst.cache import ResultCache
+from yaml4rst.reformatter import YamlRstReformatter
+
+
+def test_get_key():
+    settings_digest = YamlRstReformatter().get_settings_digest()
+    assert_equal(
+        ResultCache.get_key(b'role_name__1: []\n', settings_digest),
+        ResultCache.get_key(b'role_name__1: []\n', settings_digest),
+    )
+    assert_not_equal(
+        ResultCache.get_key(b'role_name__1: []\n', settings_digest),
+        ResultCache.get_key(b'role_name__2: []\n', settings_digest),
+    )
+    assert_not_equal(
+        ResultCache.get_key(b'role_name__1: []\n', settings_digest),
+        ResultCache.get_key(
+            b'role_name__1: []\n',
+            YamlRstReformatter(config={'ansible_full_role_name': 'role_owner.role_name'}).get_settings_digest(),
+        ),
+    )
+
+
+def test_settings_digest_memoized():
+    settings_digest = YamlRstReformatter().get_settings_digest()
+    # The template files are not read again.
+    with unittest.mock.patch('os.listdir', side_effect=AssertionError):
+        assert_equal(settings_digest, YamlRstReformatter().get_settings_digest())
+        assert_equal(settings_digest, YamlRstReformatter(config={}).get_settings_digest())
+
+
+@tempdir()
+def test_formatted(d):
+    cache = ResultCache(d.path)
+    key = ResultCache.get_key(b'role_name__1: []\n', YamlRstReformatter().get_settings_digest())
+    assert_equal(None, cache.get_warnings(key))
+
+    cache.set_formatted(key, [])
+    assert_equal([], cache.get_warnings(key))
+
+    cache.set_formatted(key, ['Warning 1', 'Warning 2'])
+    assert_equal(['Warning 1', 'Warning 2'], cache.get_warnings(key))
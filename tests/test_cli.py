@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import functools
+import os
+import re
+import shutil
+import subprocess
+import sys
+import logging
+import unittest
+import unittest.mock
+import io
+from io import BytesIO, StringIO
+
+from nose.tools import assert_equal
+from testfixtures import TempDirectory
+
+from yaml4rst.cli import get_check_summary, main, reformat_file, reformat_stream
+from yaml4rst.reformatter import LOG
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class _MessageCollector(logging.Handler):
+
+    def __init__(self):
+        super(_MessageCollector, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelname, record.getMessage()))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        LOG.setLevel(logging.CRITICAL)
+        self.tmp_dir = TempDirectory()
+        self.config = {'ansible_full_role_name': 'debops.apt_install'}
+        self.formatted_file = os.path.join(self.tmp_dir.path, 'formatted.yml')
+        shutil.copy(os.path.join(TESTS_DIR, 'output_files', 'debops.apt_install.yml'), self.formatted_file)
+        self.unformatted_file = os.path.join(self.tmp_dir.path, 'unformatted.yml')
+        shutil.copy(os.path.join(TESTS_DIR, 'input_files', 'debops.apt_install.yml'), self.unformatted_file)
+        self.invalid_file = self.tmp_dir.write('invalid.yml', b'key: [\n')
+
+    def tearDown(self):
+        # Set by main in quiet mode.
+        LOG.__dict__.pop('warning', None)
+        LOG.setLevel(logging.NOTSET)
+        self.tmp_dir.cleanup()
+
+    def _main(self, *args, **kwargs):
+        argv = ['yaml4rst', '-q']
+        if kwargs.get('config', True):
+            argv += ['-e', 'ansible_full_role_name=debops.apt_install']
+        argv += list(args)
+        stdin = io.TextIOWrapper(BytesIO(kwargs.get('stdin', b'')))
+        with unittest.mock.patch('sys.argv', argv), \
+                unittest.mock.patch('sys.stdin', stdin), \
+                unittest.mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout, \
+                unittest.mock.patch('sys.stderr', new_callable=StringIO):
+            try:
+                main()
+            except SystemExit as err:
+                return err.code, mock_stdout.getvalue()
+        return 0, mock_stdout.getvalue()
+
+    def test_reformat_file_check(self):
+        with open(self.unformatted_file, 'rb') as input_fh:
+            input_content = input_fh.read()
+
+        assert_equal(False, reformat_file(self.formatted_file, None, 'debops/ansible', self.config, check=True))
+        assert_equal(True, reformat_file(self.unformatted_file, None, 'debops/ansible', self.config, check=True))
+        assert_equal(None, reformat_file(self.invalid_file, None, 'debops/ansible', self.config, check=True))
+
+        with open(self.unformatted_file, 'rb') as input_fh:
+            assert_equal(input_content, input_fh.read())
+
+    def test_main_check(self):
+        assert_equal((0, ''), self._main('--check', self.formatted_file))
+        assert_equal(
+            (1, self.unformatted_file + '\n'),
+            self._main('--check', self.formatted_file, self.unformatted_file),
+        )
+        assert_equal(
+            (2, self.unformatted_file + '\n'),
+            self._main('--check', self.invalid_file, self.unformatted_file, self.formatted_file),
+        )
+
+    def test_main_diff(self):
+        assert_equal((0, ''), self._main('--diff', self.formatted_file))
+
+        exit_code, diff = self._main('--diff', '--check', '-j', '2', self.formatted_file, self.unformatted_file)
+        assert_equal(1, exit_code)
+        assert_equal(True, diff.startswith('--- {0}\n+++ {0}\n@@ '.format(self.unformatted_file)))
+
+    def test_main_in_place(self):
+        os.chmod(self.unformatted_file, 0o640)
+        with open(self.formatted_file, 'rb') as output_fh:
+            output_content = output_fh.read()
+
+        for fsync in ['never', 'file', 'batch']:
+            shutil.copyfile(os.path.join(TESTS_DIR, 'input_files', 'debops.apt_install.yml'), self.unformatted_file)
+            assert_equal(
+                (0, ''),
+                self._main('-i', '--fsync', fsync, '-j', '2', self.formatted_file, self.unformatted_file),
+            )
+            with open(self.unformatted_file, 'rb') as output_fh:
+                assert_equal(output_content, output_fh.read())
+            assert_equal(0o640, os.stat(self.unformatted_file).st_mode & 0o777)
+
+    def test_main_directory(self):
+        role_dir = self.tmp_dir.makedir('roles/debops.apt_install')
+        self.tmp_dir.makedir('roles/debops.apt_install/tasks')
+        self.tmp_dir.makedir('roles/debops.apt_install/defaults')
+        shutil.copy(self.formatted_file, os.path.join(role_dir, 'defaults', 'main.yml'))
+        assert_equal((0, ''), self._main('--check', self.tmp_dir.getpath('roles'), config=False))
+
+        # Derived from the directory name.
+        os.rename(role_dir, self.tmp_dir.getpath('roles/debops.other'))
+        assert_equal(
+            (1, self.tmp_dir.getpath('roles/debops.other/defaults/main.yml') + '\n'),
+            self._main('--check', '-j', '2', self.tmp_dir.getpath('roles'), config=False),
+        )
+        assert_equal((0, ''), self._main('--check', self.tmp_dir.getpath('roles')))
+
+        assert_equal(2, self._main(self.tmp_dir.getpath('roles'))[0])
+
+    def test_main_stdin_jobs(self):
+        with open(self.unformatted_file, 'rb') as input_fh:
+            input_content = input_fh.read()
+        with open(self.formatted_file, 'rb') as output_fh:
+            output_content = output_fh.read()
+        output_files = [self.tmp_dir.getpath('stdin.yml'), self.tmp_dir.getpath('file.yml')]
+
+        for jobs in ['1', '2']:
+            assert_equal(
+                (0, ''),
+                self._main(
+                    '-j', jobs, '-', self.unformatted_file, '-o', output_files[0], output_files[1],
+                    stdin=input_content,
+                ),
+            )
+            for output_file in output_files:
+                with open(output_file, 'rb') as output_fh:
+                    assert_equal(output_content, output_fh.read())
+                os.unlink(output_file)
+
+    def test_main_jobs_like_serial(self):
+        argv = ['yaml4rst', '-e', 'ansible_full_role_name=debops.other']
+        input_files = [self.unformatted_file, self.invalid_file, self.formatted_file]
+        log_handler = _MessageCollector()
+        LOG.setLevel(logging.WARNING)
+        LOG.addHandler(log_handler)
+        results = {}
+        try:
+            for jobs in ['1', '2']:
+                output_dir = self.tmp_dir.makedir('jobs_' + jobs)
+                output_files = [os.path.join(output_dir, str(index)) for index in range(len(input_files))]
+                result = []
+                for args in [['-o'] + output_files, ['--check']]:
+                    log_handler.messages = []
+                    with unittest.mock.patch('sys.argv', argv + ['-j', jobs] + input_files + args), \
+                            unittest.mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout, \
+                            unittest.mock.patch('sys.stderr', new_callable=StringIO):
+                        try:
+                            main()
+                            exit_code = 0
+                        except SystemExit as err:
+                            exit_code = err.code
+                    result.append((exit_code, mock_stdout.getvalue(), log_handler.messages))
+                result.append(sorted(os.listdir(output_dir)))
+                for output_file in output_files[::2]:
+                    with open(output_file, 'rb') as output_fh:
+                        result.append(output_fh.read())
+                results[jobs] = result
+        finally:
+            LOG.removeHandler(log_handler)
+
+        assert_equal(results['1'], results['2'])
+        assert_equal(2, results['1'][1][0])
+        assert_equal(['0', '2'], results['1'][2])
+        assert_equal(
+            ['WARNING', 'ERROR', 'WARNING'],
+            [
+                levelname for levelname, message in results['1'][0][2]
+                if re.search(r'apt_install__base_packages|not valid YAML', message)
+            ],
+        )
+
+    def test_main_staged(self):
+        git_environ = {key: value for key, value in os.environ.items() if not key.startswith('GIT_')}
+        git_args = ['git', '-c', 'user.name=yaml4rst', '-c', 'user.email=yaml4rst@example.org']
+        role_dir = self.tmp_dir.makedir('roles/debops.apt_install')
+        self.tmp_dir.makedir('roles/debops.apt_install/tasks')
+        defaults_file = os.path.join(self.tmp_dir.makedir('roles/debops.apt_install/defaults'), 'main.yml')
+        shutil.copy(self.unformatted_file, defaults_file)
+        rel_defaults_file = os.path.join('roles', 'debops.apt_install', 'defaults', 'main.yml')
+        with open(self.formatted_file, 'rb') as output_fh:
+            output_content = output_fh.read()
+
+        old_cwd = os.getcwd()
+        with unittest.mock.patch.dict(os.environ, git_environ, clear=True):
+            os.chdir(self.tmp_dir.path)
+            try:
+                for git_command in [['init', '-q'], ['commit', '-q', '--allow-empty', '-m', 'Initial commit']]:
+                    subprocess.run(git_args + git_command, stdout=subprocess.DEVNULL, check=True)
+
+                # The staged content is checked.
+                subprocess.run(git_args + ['add', defaults_file], check=True)
+                shutil.copy(self.formatted_file, defaults_file)
+                assert_equal((1, rel_defaults_file + '\n'), self._main('--staged', '--check', role_dir, config=False))
+
+                # Files with unstaged changes are not edited in place.
+                with open(defaults_file, 'ab') as output_fh:
+                    output_fh.write(b'apt_install__unstaged: True\n')
+                assert_equal((0, ''), self._main('--staged', '-i', config=False))
+                with open(defaults_file, 'rb') as output_fh:
+                    assert_equal(output_content + b'apt_install__unstaged: True\n', output_fh.read())
+
+                shutil.copy(self.unformatted_file, defaults_file)
+                assert_equal((0, ''), self._main('--staged', '-i', config=False))
+                with open(defaults_file, 'rb') as output_fh:
+                    assert_equal(output_content, output_fh.read())
+
+                subprocess.run(git_args + ['add', defaults_file], check=True)
+                assert_equal((0, ''), self._main('--staged', '--check', config=False))
+            finally:
+                os.chdir(old_cwd)
+
+    def test_reformat_file_error_names_file(self):
+        log_handler = _MessageCollector()
+        LOG.setLevel(logging.ERROR)
+        LOG.addHandler(log_handler)
+        try:
+            assert_equal(None, reformat_file(self.unformatted_file, None, 'debops/ansible', {}, check=True))
+        finally:
+            LOG.removeHandler(log_handler)
+        assert_equal(
+            [('ERROR', self.unformatted_file + ": 'ansible_full_role_name' is undefined."
+              " Consider providing the variable as config option.")],
+            log_handler.messages,
+        )
+
+    def test_main_directory_unreadable(self):
+        role_dir = self.tmp_dir.makedir('roles/debops.apt_install')
+        self.tmp_dir.makedir('roles/debops.apt_install/tasks')
+        self.tmp_dir.makedir('roles/debops.apt_install/defaults')
+        shutil.copy(self.formatted_file, os.path.join(role_dir, 'defaults', 'main.yml'))
+        unreadable_dir = self.tmp_dir.makedir('roles/debops.other')
+        scandir = os.scandir
+
+        def mock_scandir(path):
+            if path == unreadable_dir:
+                raise PermissionError(13, 'Permission denied', path)
+            return scandir(path)
+
+        with unittest.mock.patch('os.scandir', mock_scandir):
+            assert_equal((2, ''), self._main('--check', self.tmp_dir.getpath('roles'), config=False))
+
+    def test_reformat_file_changed(self):
+        output_file = self.tmp_dir.getpath('output.yml')
+        assert_equal(False, reformat_file(self.formatted_file, output_file, 'debops/ansible', self.config))
+        assert_equal(True, reformat_file(self.unformatted_file, output_file, 'debops/ansible', self.config))
+        assert_equal(None, reformat_file(self.invalid_file, output_file, 'debops/ansible', self.config))
+
+    def test_main_in_place_summary(self):
+        argv = ['yaml4rst', '-e', 'ansible_full_role_name=debops.apt_install', '-i']
+        with unittest.mock.patch('sys.argv', argv + [self.formatted_file, self.unformatted_file]), \
+                unittest.mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            main()
+        assert_equal("1 file changed, 1 file already formatted.\n", mock_stderr.getvalue())
+
+    def test_reformat_stream(self):
+        input_contents = []
+        for input_file in [self.unformatted_file, self.invalid_file, self.formatted_file]:
+            with open(input_file, 'rb') as input_fh:
+                input_contents.append(input_fh.read())
+        output_fh = BytesIO()
+        process_file = functools.partial(reformat_file, preset='debops/ansible', config=self.config)
+
+        assert_equal(
+            1,
+            reformat_stream(process_file, BytesIO(b'\0'.join(input_contents)), output_fh),
+        )
+        assert_equal(
+            b'\0'.join([input_contents[2], input_contents[1], input_contents[2], b'']),
+            output_fh.getvalue(),
+        )
+
+    def test_import(self):
+        # The CLI does not load the reformatter before it is needed.
+        subprocess.run(
+            [sys.executable, '-c', "import sys, yaml4rst.cli; assert 'yaml4rst.reformatter' not in sys.modules"],
+            cwd=os.path.dirname(TESTS_DIR),
+            check=True,
+        )
+
+        namespace = {}
+        exec('from yaml4rst import *', namespace)  # pylint: disable=exec-used
+        assert_equal(
+            ['YAML_RST_REFORMATTER_FEATURES', 'YamlRstReformatter', 'YamlRstReformatterError'],
+            sorted(name for name in namespace if name != '__builtins__'),
+        )
+
+    def test_get_check_summary(self):
+        assert_equal(
+            "1 file would be changed, 2 files already formatted.",
+            get_check_summary({True: 1, False: 2, None: 0}),
+        )
+        assert_equal(
+            "0 files would be changed, 1 file already formatted. 3 files could not be processed.",
+            get_check_summary({True: 0, False: 1, None: 3}),
+        )
+        assert_equal(
+            "2 files changed, 0 files already formatted.",
+            get_check_summary({True: 2, False: 0, None: 0}, in_place=True),
+        )
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+import logging
+import unittest
+
+from nose.tools import assert_equal, assert_in, assert_raises_regexp
+from testfixtures import TempDirectory
+
+from yaml4rst.cli import reformat_file, reformat_file_via_daemon
+from yaml4rst.daemon import YamlRstDaemon, request
+from yaml4rst.reformatter import YamlRstReformatterError, LOG
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        self.tmp_dir = TempDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.path, 'yaml4rst.sock')
+        self.daemon = YamlRstDaemon(self.socket_path, loglevel=logging.CRITICAL)
+        self.daemon_thread = threading.Thread(target=self.daemon.serve_forever)
+        self.daemon_thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.daemon_thread.join()
+        self.daemon.server_close()
+        self.tmp_dir.cleanup()
+        assert_equal(True, LOG.propagate)
+
+    def test_reformat_input_file(self):
+        response_data = request(self.socket_path, {
+            'input_file': os.path.join(TESTS_DIR, 'input_files', 'debops.apt_install.yml'),
+            'config': {'ansible_full_role_name': 'debops.apt_install'},
+        })
+
+        output_file = os.path.join(TESTS_DIR, 'output_files', 'debops.apt_install.yml')
+        with open(output_file, 'r', encoding='utf-8') as output_fh:
+            assert_equal(output_fh.read(), response_data['output'])
+        assert_equal(True, response_data['changed'])
+        assert_equal([], response_data['warnings'])
+
+    def test_reformat_content(self):
+        response_data = request(self.socket_path, {
+            'content': 'role_name__1: []\nrole_name2: []\n',
+            'config': {'ansible_full_role_name': 'role_owner.role_name'},
+        })
+
+        assert_in('# .. envvar:: role_name__1 [[[\n', response_data['output'])
+        assert_equal(True, response_data['changed'])
+        assert_equal(3, len(response_data['warnings']))
+        assert_in("The variable 'role_name2' is outside of the 'role_name' namespace.", response_data['warnings'][-1])
+
+    def test_reformat_diff(self):
+        response_data = request(self.socket_path, {
+            'content': 'role_name__1: []\n',
+            'config': {'ansible_full_role_name': 'role_owner.role_name'},
+            'diff': True,
+        })
+
+        assert_equal(True, response_data['diff'].startswith('--- -\n+++ -\n'))
+        assert_in('+# .. envvar:: role_name__1 [[[\n', response_data['diff'])
+
+    def test_reformat_diff_file_name(self):
+        input_file = os.path.relpath(os.path.join(TESTS_DIR, 'input_files', 'debops.apt_install.yml'))
+        config = {'ansible_full_role_name': 'debops.apt_install'}
+        diff = reformat_file_via_daemon(self.socket_path, input_file, None, 'debops/ansible', config, diff=True)
+
+        assert_equal(True, diff.startswith('--- {0}\n+++ {0}\n'.format(input_file)))
+        assert_equal(reformat_file(input_file, None, 'debops/ansible', config, diff=True), diff)
+
+    def test_reformat_error(self):
+        response_data = request(self.socket_path, {'content': 'role_name__1: ['})
+
+        assert_equal(False, 'output' in response_data)
+        assert_in('expected', response_data['error'])
+
+    def test_reformat_error_not_utf8(self):
+        input_file = self.tmp_dir.write('invalid.yml', b'---\n# \xff\xfe\n')
+        response_data = request(self.socket_path, {'input_file': input_file})
+        assert_equal(False, 'output' in response_data)
+        assert_in("can't decode byte 0xff", response_data['error'])
+
+        LOG.setLevel(logging.CRITICAL)
+        try:
+            assert_equal(None, reformat_file_via_daemon(self.socket_path, input_file, '-', 'debops/ansible', {}))
+        finally:
+            LOG.setLevel(logging.NOTSET)
+
+    def test_reformat_unexpected_error(self):
+        logging.getLogger('yaml4rst.daemon').disabled = True
+        try:
+            response_data = request(self.socket_path, {'content': 1})
+        finally:
+            logging.getLogger('yaml4rst.daemon').disabled = False
+        assert_equal([], response_data['warnings'])
+        assert_in('Internal error of the daemon', response_data['error'])
+
+    def test_already_running(self):
+        assert_raises_regexp(
+            YamlRstReformatterError,
+            'A daemon is already listening on',
+            YamlRstDaemon,
+            self.socket_path,
+        )
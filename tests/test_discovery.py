@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import unittest
+import unittest.mock
+
+from nose.tools import assert_equal
+from testfixtures import LogCapture, TempDirectory
+
+from yaml4rst.discovery import (
+    iter_input_files, iter_git_changed_files, read_git_staged_file, get_ansible_full_role_name,
+)
+from yaml4rst.reformatter import YamlRstReformatterError
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDirectory()
+        self.tmp_dir.write('roles/debops.apt/defaults/main.yml', b'---\n')
+        self.tmp_dir.write('roles/debops.apt/tasks/main.yml', b'---\n')
+        self.tmp_dir.write('roles/debops.apt/vars/main.yml', b'---\n')
+        self.tmp_dir.write('roles/ntp/defaults/main.yml', b'---\n')
+        self.tmp_dir.write('roles/ntp/meta/main.yml', b'---\ngalaxy_info:\n  namespace: debops\n')
+        self.tmp_dir.write('roles/unknown/defaults/main.yml', b'---\n')
+        self.tmp_dir.write('roles/unknown/meta/main.yml', b'---\ngalaxy_info:\n  author: ypid\n')
+        self.tmp_dir.write('roles/.git/defaults/main.yml', b'---\n')
+        self.tmp_dir.write('defaults/main.yml', b'---\n')
+        os.symlink(
+            os.path.join(self.tmp_dir.path, 'roles'),
+            os.path.join(self.tmp_dir.path, 'roles', 'debops.apt', 'roles'),
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _rel_paths(self, paths):
+        return [os.path.relpath(path, self.tmp_dir.path) for path in paths]
+
+    def test_iter_input_files(self):
+        assert_equal(
+            [
+                'defaults/main.yml',
+                'roles/debops.apt/defaults/main.yml',
+                'roles/ntp/defaults/main.yml',
+                'roles/unknown/defaults/main.yml',
+            ],
+            self._rel_paths(iter_input_files([self.tmp_dir.path])),
+        )
+        missing_file = self.tmp_dir.getpath('missing.yml')
+        assert_equal(
+            ['-', self.tmp_dir.getpath('roles/ntp/defaults/main.yml'), missing_file],
+            list(iter_input_files(
+                ['-', self.tmp_dir.getpath('roles/ntp'), missing_file],
+                exclude_patterns=['.git'],
+            )),
+        )
+
+    def test_iter_input_files_unreadable_dir(self):
+        unreadable_dir = self.tmp_dir.getpath('roles/ntp')
+        scandir = os.scandir
+
+        def mock_scandir(path):
+            if path == unreadable_dir:
+                raise PermissionError(13, 'Permission denied', path)
+            return scandir(path)
+
+        errors = []
+        with unittest.mock.patch('os.scandir', mock_scandir), \
+                LogCapture('yaml4rst.discovery') as log:
+            assert_equal(
+                ['roles/debops.apt/defaults/main.yml', 'roles/unknown/defaults/main.yml'],
+                self._rel_paths(iter_input_files([self.tmp_dir.getpath('roles')], onerror=errors.append)),
+            )
+        assert_equal([unreadable_dir], [err.filename for err in errors])
+        log.check(
+            ('yaml4rst.discovery', 'ERROR', 'Could not read directory {}: Permission denied'.format(unreadable_dir)),
+        )
+
+    def test_iter_input_files_patterns(self):
+        assert_equal(
+            [
+                'roles/.git/defaults/main.yml',
+                'roles/debops.apt/defaults/main.yml',
+                'roles/debops.apt/tasks/main.yml',
+                'roles/debops.apt/vars/main.yml',
+            ],
+            self._rel_paths(iter_input_files(
+                [self.tmp_dir.getpath('roles')],
+                include_patterns=['*.yml'],
+                exclude_patterns=['ntp', 'unknown'],
+            )),
+        )
+
+    def _git(self, *git_args):
+        subprocess.run(
+            ['git', '-c', 'user.name=yaml4rst', '-c', 'user.email=yaml4rst@example.org'] + list(git_args),
+            cwd=self.tmp_dir.path,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def test_iter_git_changed_files(self):
+        # Variables set by git for hooks would point to another repository.
+        git_environ = {key: value for key, value in os.environ.items() if not key.startswith('GIT_')}
+        with unittest.mock.patch.dict(os.environ, git_environ, clear=True):
+            old_cwd = os.getcwd()
+            os.chdir(self.tmp_dir.path)
+            try:
+                self._git('init', '-q')
+                self._git('add', '.')
+                # Without commits, all staged files are changed.
+                assert_equal(
+                    [
+                        'defaults/main.yml',
+                        os.path.join('roles', 'debops.apt', 'defaults', 'main.yml'),
+                        os.path.join('roles', 'ntp', 'defaults', 'main.yml'),
+                        os.path.join('roles', 'unknown', 'defaults', 'main.yml'),
+                    ],
+                    list(iter_git_changed_files(staged=True)),
+                )
+                self._git('commit', '-q', '-m', 'Initial commit')
+
+                self.tmp_dir.write('roles/debops.apt/defaults/main.yml', b'---\n# Changed\n')
+                self.tmp_dir.write('roles/debops.apt/tasks/main.yml', b'---\n# Changed\n')
+                os.unlink(self.tmp_dir.getpath('roles/ntp/defaults/main.yml'))
+                self.tmp_dir.write('roles/unknown/defaults/main.yml', b'---\n# Staged\n')
+                self._git('add', 'roles/unknown/defaults/main.yml')
+
+                assert_equal(
+                    [
+                        os.path.join('roles', 'debops.apt', 'defaults', 'main.yml'),
+                        os.path.join('roles', 'unknown', 'defaults', 'main.yml'),
+                    ],
+                    list(iter_git_changed_files(ref='HEAD')),
+                )
+                assert_equal(
+                    [os.path.join('roles', 'unknown', 'defaults', 'main.yml')],
+                    list(iter_git_changed_files(staged=True)),
+                )
+                assert_equal(
+                    [os.path.join('roles', 'debops.apt', 'tasks', 'main.yml')],
+                    list(iter_git_changed_files(['roles/debops.apt'], include_patterns=['tasks/*.yml'])),
+                )
+
+                os.chdir(self.tmp_dir.getpath('roles'))
+                assert_equal(
+                    [os.path.join('unknown', 'defaults', 'main.yml')],
+                    list(iter_git_changed_files(['.'], staged=True)),
+                )
+
+                self.tmp_dir.write('roles/unknown/defaults/main.yml', b'---\n# Not staged\n')
+                assert_equal(b'---\n# Staged\n', read_git_staged_file(os.path.join('unknown', 'defaults', 'main.yml')))
+                assert_equal(
+                    b'---\n# Staged\n',
+                    read_git_staged_file(self.tmp_dir.getpath('roles/unknown/defaults/main.yml')),
+                )
+
+                with self.assertRaises(YamlRstReformatterError):
+                    list(iter_git_changed_files(ref='does-not-exist'))
+            finally:
+                os.chdir(old_cwd)
+
+    def test_get_ansible_full_role_name(self):
+        assert_equal(
+            'debops.apt',
+            get_ansible_full_role_name(self.tmp_dir.getpath('roles/debops.apt/defaults/main.yml')),
+        )
+        assert_equal(
+            'debops.ntp',
+            get_ansible_full_role_name(self.tmp_dir.getpath('roles/ntp/defaults/main.yml')),
+        )
+        assert_equal(None, get_ansible_full_role_name(self.tmp_dir.getpath('roles/unknown/defaults/main.yml')))
+        assert_equal(None, get_ansible_full_role_name(self.tmp_dir.getpath('roles/debops.apt/vars/main.yml')))
+        assert_equal(None, get_ansible_full_role_name(self.tmp_dir.getpath('defaults/main.yml')))
@@ -2,11 +2,15 @@
 
 from __future__ import absolute_import, division, print_function
 
+import difflib
 import textwrap
 
-from nose.tools import assert_equal, assert_not_equal
+from nose.tools import assert_equal, assert_not_equal, assert_raises, assert_in
+import yaml
 
-from yaml4rst.helpers import get_first_match, list_index, get_last_index, get_last_match, strip_list
+from yaml4rst.helpers import (
+    get_first_match, list_index, get_last_index, get_last_match, strip_list, validate_yaml, get_unified_diff,
+)
 
 
 def test_list_index():
@@ -128,3 +132,39 @@ def test_strip_list():
     assert_equal(input_lines, strip_list(input_lines))
     assert_equal(input_lines, strip_list([''] + input_lines))
     assert_equal(input_lines, strip_list(input_lines + ['']))
+
+
+def test_validate_yaml():
+    assert_in(validate_yaml('---\nrole_name__1: []\nrole_name__2: !unsafe "{{ test }}"'), ['libyaml', 'python'])
+    assert_raises(yaml.YAMLError, validate_yaml, 'role_name__1: [')
+    assert_raises(yaml.YAMLError, validate_yaml, 'role_name__1: *undefined_alias')
+    assert_raises(yaml.YAMLError, validate_yaml, '---\nrole_name__1: 1\n---\nrole_name__2: 2')
+
+
+def test_get_unified_diff():
+    from_lines = ['---', 'a: 1', 'b: 2', 'c: 3', 'd: 4', 'e: 5', 'f: 6', 'g: 7', 'h: 8']
+    to_lines = ['---', 'a: 1', 'b: 2', 'c: 3', 'd: 4', 'e: 5', 'f: 6', 'g: 7', 'h: 8']
+    assert_equal([], list(get_unified_diff(from_lines, to_lines)))
+
+    to_lines[1:1] = ['#', '# Comment']
+    to_lines[7] = 'f: 7'
+    del to_lines[-1]
+    assert_equal(
+        [line + '\n' for line in difflib.unified_diff(from_lines, to_lines, 'a', 'b', n=1, lineterm='')],
+        list(get_unified_diff(from_lines, to_lines, 'a', 'b', context_line_count=1)),
+    )
+    assert_equal(
+        [line + '\n' for line in difflib.unified_diff(from_lines, [], 'a', 'b', lineterm='')],
+        list(get_unified_diff(from_lines, [], 'a', 'b')),
+    )
+
+    # Unique lines are kept as anchors.
+    from_lines = ['# ]]]', '', 'a: 1', '# ]]]', '', 'b: 2', '# ]]]']
+    to_lines = ['# ]]]', 'a: 1', '', '# ]]]', 'b: 2', '', '# ]]]']
+    assert_equal(
+        [
+            '--- \n', '+++ \n', '@@ -1,7 +1,7 @@\n',
+            ' # ]]]\n', '-\n', ' a: 1\n', '+\n', ' # ]]]\n', '-\n', ' b: 2\n', '+\n', ' # ]]]\n',
+        ],
+        list(get_unified_diff(from_lines, to_lines)),
+    )
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import logging
+import unittest
+import unittest.mock
+
+from nose.tools import assert_equal
+
+from yaml4rst.reformatter import YamlRstReformatter, LOG
+from yaml4rst.section import Section
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Test(unittest.TestCase):
+    """Regression tests for the real world data in :file:`tests/input_files`.
+
+    Refer to the ``check-real-data`` target in the Makefile for how :file:`tests/output_files` are generated.
+    """
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        LOG.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        LOG.setLevel(logging.NOTSET)
+
+    @staticmethod
+    def _get_reformatter(file_name):
+        return YamlRstReformatter(
+            config={
+                'ansible_full_role_name': os.path.splitext(file_name)[0],
+            },
+        )
+
+    def test_output_files(self):
+        input_dir = os.path.join(TESTS_DIR, 'input_files')
+        for file_name in sorted(os.listdir(input_dir)):
+            reformatter = self._get_reformatter(file_name)
+            reformatter.read_file(os.path.join(input_dir, file_name))
+            reformatter.reformat()
+
+            with open(os.path.join(TESTS_DIR, 'output_files', file_name), 'r', encoding='utf-8') as output_fh:
+                assert_equal(output_fh.read(), reformatter.get_content() + '\n', file_name)
+
+    def test_output_files_idempotency(self):
+        output_dir = os.path.join(TESTS_DIR, 'output_files')
+        for file_name in sorted(os.listdir(output_dir)):
+            reformatter = self._get_reformatter(file_name)
+            reformatter.read_file(os.path.join(output_dir, file_name))
+            reformatter.reformat()
+            assert_equal(False, reformatter.is_input_and_output_different(), file_name)
+
+    def test_no_section_formatting_at_default_log_level(self):
+        """Sections are never stringified for log messages which are not emitted."""
+
+        def fail_repr(section):
+            raise AssertionError("Section was formatted: {}".format(dict(section.items())))
+
+        LOG.setLevel(logging.WARNING)
+        input_dir = os.path.join(TESTS_DIR, 'input_files')
+        with unittest.mock.patch.object(Section, '__repr__', fail_repr):
+            for file_name in sorted(os.listdir(input_dir)):
+                reformatter = self._get_reformatter(file_name)
+                reformatter.read_file(os.path.join(input_dir, file_name))
+                reformatter.reformat()
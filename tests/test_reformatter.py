@@ -4,6 +4,7 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+import sys
 import textwrap
 import pprint
 import logging
@@ -12,10 +13,11 @@ from io import StringIO
 import unittest
 # Python 2 does not yet have `mock` which was a separate package back then.
 
-from nose.tools import assert_equal, assert_not_equal, assert_raises_regexp  # NOQA
+from nose.tools import assert_equal, assert_in, assert_not_equal, assert_raises_regexp  # NOQA
 from testfixtures import log_capture, tempdir
 
-from yaml4rst.reformatter import YamlRstReformatter, YamlRstReformatterError, LOG
+from yaml4rst.reformatter import YamlRstReformatter, YamlRstReformatterError, LOG, _YamlBlockState
+from yaml4rst.tokenizer import tokenize_lines
 from yaml4rst.defaults import DEFAULTS
 
 
@@ -117,6 +119,161 @@ class Test(unittest.TestCase):
         assert_not_equal(d.read('main.yml', 'utf-8'), input_data + '\n')
         assert_not_equal(input_data, self.r.get_content(), input_data)
 
+    def test_validate_yaml_once_if_unchanged(self):
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output_files', 'debops.apt_install.yml')
+        self.r = YamlRstReformatter(config={'ansible_full_role_name': 'debops.apt_install'})
+
+        with unittest.mock.patch('yaml4rst.reformatter.validate_yaml') as validate_yaml:
+            self.r.read_file(file_path)
+            self.r.reformat()
+            assert_equal(1, validate_yaml.call_count)
+
+            self.r._lines.append('# Comment')
+            self.r.reformat()
+            assert_equal(2, validate_yaml.call_count)
+
+    def test_original_lines(self):
+        self.r.read_string('---\n# Comment   \r\nvar: 1\n')
+        assert_equal('---\n# Comment\nvar: 1', self.r._original_content)
+        assert_equal(['---', '# Comment', 'var: 1'], self.r._original_lines)
+        assert_equal(False, self.r.is_input_and_output_different())
+
+        self.r._lines.append('')
+        assert_equal(True, self.r.is_input_and_output_different())
+
+        self.r.read_string('')
+        assert_equal([], self.r._original_lines)
+        self.r.read_string('\n')
+        assert_equal([''], self.r._original_lines)
+
+    def test_is_input_and_output_different(self):
+        self.r.read_string('---\nrole_name__1: []\n')
+        self.r.reformat()
+        content = self.r.get_content()
+        assert_equal(True, self.r.is_input_and_output_different())
+        # The output is only joined once.
+        assert_equal(True, self.r.get_content() is content)
+
+        self.r.read_string(content + '\n')
+        self.r.reformat()
+        assert_equal(False, self.r.is_input_and_output_different())
+
+        # Lines only added at the end.
+        self.r._lines.extend(['', '# Comment'])
+        assert_equal(True, self.r.is_input_and_output_different())
+        assert_equal(content + '\n\n# Comment', self.r.get_content())
+
+    def test_is_input_and_output_different_lines_changed(self):
+        input_content = '---\nrole_name__1: []\n'
+        lines = self.r.reformat_lines(input_content.split('\n'))
+        content = self.r.get_content()
+
+        # The returned lines are a copy.
+        lines[-1] = '# Changed'
+        assert_equal(content, self.r.get_content())
+
+        self.r.read_string(content + '\n')
+        self.r.reformat()
+        assert_equal(False, self.r.is_input_and_output_different())
+        self.r._lines[-1] = '# Changed'
+        assert_equal(True, self.r.is_input_and_output_different())
+        assert_equal(True, self.r.get_content().endswith('\n# Changed'))
+
+    def test_get_diff(self):
+        self.r.read_string('---\nrole_name__1: []\n')
+        assert_equal('', self.r.get_diff())
+
+        self.r.reformat()
+        diff = self.r.get_diff(from_file='main.yml', to_file='main.yml')
+        assert_equal(True, diff.startswith('--- main.yml\n+++ main.yml\n@@ -1,2 +1,'))
+        assert_in('+# .. envvar:: role_name__1 [[[\n', diff)
+        assert_in(' role_name__1: []\n', diff)
+
+    def test_is_formatted(self):
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        config = {'ansible_full_role_name': 'debops.apt_install'}
+
+        self.r = YamlRstReformatter(config=config)
+        self.r.read_file(os.path.join(tests_dir, 'input_files', 'debops.apt_install.yml'))
+        assert_equal(False, self.r._is_formatted())
+
+        self.r = YamlRstReformatter(config=config)
+        self.r.read_file(os.path.join(tests_dir, 'output_files', 'debops.apt_install.yml'))
+        assert_equal(True, self.r._is_formatted())
+        with unittest.mock.patch.object(self.r, '_reformat_sections') as reformat_sections:
+            self.r.reformat()
+            assert_equal(False, reformat_sections.called)
+        assert_equal(False, self.r.is_input_and_output_different())
+
+        # Legacy RST section inside of a section.
+        self.r._lines[self.r._lines.index('# ----------------------') + 1:0] = [
+            '',
+            '# Heading',
+            '# =======',
+        ]
+        assert_equal(False, self.r._is_formatted())
+
+    @log_capture(level=logging.WARNING)
+    def test_reformat_string_reuse_instance(self, log):
+        self.r = YamlRstReformatter(config={'ansible_full_role_name': 'role_owner.role_name'})
+        self.r.reformat_string('---\n# Comment\nother_var: 1\n')
+        log.clear()
+
+        content = self.r.reformat_string('---\n# Comment\nrole_name__var: 1\n')
+        warnings = [record.getMessage() for record in log.records if record.levelno == logging.WARNING]
+        assert_equal([], warnings)
+        assert_equal(
+            YamlRstReformatter(
+                config={'ansible_full_role_name': 'role_owner.role_name'},
+            ).reformat_string('---\n# Comment\nrole_name__var: 1\n'),
+            content,
+        )
+
+    @log_capture(level=logging.WARNING)
+    def test_is_formatted_check_var_names(self, log):
+        content = YamlRstReformatter(
+            config={'ansible_full_role_name': 'role_owner.role_name'},
+        ).reformat_string('---\n# Comment\nvar: 1\n')
+        log.clear()
+
+        self.r = YamlRstReformatter(config={'ansible_full_role_name': 'role_owner.role_name'})
+        self.r.read_string(content)
+        assert_equal(True, self.r._is_formatted())
+        self.r.reformat()
+        assert_equal(content, self.r.get_content() + '\n')
+        warnings = [record.getMessage() for record in log.records if record.levelno == logging.WARNING]
+        assert_equal(1, len(warnings))
+        assert_in("The variable 'var' is outside of the 'role_name' namespace.", warnings[0])
+
+    def test_reformat_in_memory(self):
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(tests_dir, 'input_files', 'debops.apt_install.yml'), 'r') as input_fh:
+            input_content = input_fh.read()
+        with open(os.path.join(tests_dir, 'output_files', 'debops.apt_install.yml'), 'r') as output_fh:
+            output_content = output_fh.read()
+        config = {'ansible_full_role_name': 'debops.apt_install'}
+
+        assert_equal(
+            output_content,
+            YamlRstReformatter(config=config).reformat_string(input_content),
+        )
+        assert_equal(
+            output_content,
+            YamlRstReformatter(config=config).reformat_string(input_content.replace('\n', '\r\n')),
+        )
+        assert_equal(
+            output_content.encode('utf-8'),
+            YamlRstReformatter(config=config).reformat_bytes(input_content.encode('utf-8')),
+        )
+
+        input_lines = input_content.split('\n')
+        input_lines_copy = list(input_lines)
+        assert_equal(
+            output_content.split('\n')[:-1],
+            YamlRstReformatter(config=config).reformat_lines(input_lines),
+        )
+        assert_equal(input_lines_copy, input_lines)
+
     def test_get_rendered_template(self):
         expected_string = textwrap.dedent("""
             ---
@@ -324,6 +481,28 @@ class Test(unittest.TestCase):
             'defaults_header',
         )
 
+    def test_get_template_cached(self):
+        assert_equal(
+            id(self.r._get_template('defaults_header')),
+            id(YamlRstReformatter()._get_template('defaults_header')),
+        )
+
+    @tempdir()
+    def test_get_template_changed(self, d):
+        d.write('preset/header.j2', '# {{ ansible_full_role_name }} 1', 'utf-8')
+        self.r = YamlRstReformatter(
+            preset='preset',
+            template_path=d.path,
+            config={'ansible_full_role_name': 'role_owner.role_name'},
+            template_bytecode_cache_dir=os.path.join(d.path, 'bytecode'),
+        )
+        assert_equal('# role_owner.role_name 1', self.r._get_rendered_template('header'))
+        assert_equal(1, len(os.listdir(os.path.join(d.path, 'bytecode'))))
+
+        d.write('preset/header.j2', '# {{ ansible_full_role_name }} 2', 'utf-8')
+        os.utime(os.path.join(d.path, 'preset', 'header.j2'), ns=(0, 0))
+        assert_equal('# role_owner.role_name 2', self.r._get_rendered_template('header'))
+
     def test_get_line_fold_opening(self):
         assert_equal(
             {'change': 1, 'level': '', 'name': '.. envvar:: 1'},
@@ -652,6 +831,24 @@ class Test(unittest.TestCase):
             self.r._lines,
         )
 
+    def test_fix_closing_folds_new_lines_wanted_empty_lines(self):
+        self.r._config['wanted_empty_lines_between_items'] = 2
+        self.r._lines = [
+            "role_name__1: 'test 1'", '', '                                # ]]]', '',
+            "role_name__2: 'test 2'", '', '                                # ]]]',
+            '                                # ]]]', '',
+        ]
+        self.r._remove_needless_newlines()
+
+        assert_equal(
+            [
+                "role_name__1: 'test 1'", '', '                                # ]]]',
+                "role_name__2: 'test 2'", '                                # ]]]',
+                '                                # ]]]',
+            ],
+            self.r._lines,
+        )
+
     def test_add_rst_docs_to_yaml_vars(self):
         self.r._lines = textwrap.dedent("""
             role_name__1: []
@@ -985,6 +1182,23 @@ class Test(unittest.TestCase):
             self.r._sections,
         )
 
+    def test_get_sections_for_lines_deeply_nested(self):
+        # Debug output of the section tree would exceed the recursion limit.
+        LOG.setLevel(logging.INFO)
+        depth = sys.getrecursionlimit() * 2
+        self.r._lines = ['# {} [[['.format(level) for level in range(depth)] + ['test: []'] + ['# ]]]'] * depth
+        _, self.r._sections = self.r._get_sections_for_lines(self.r._lines)
+
+        sections = self.r._sections
+        for level in range(depth - 1):
+            assert_equal(1, len(sections))
+            assert_equal(str(level), sections[0]['fold_name'])
+            sections = sections[0]['subsections']
+        assert_equal(
+            [{'fold_name': str(depth - 1), 'lines': ['test: []']}],
+            sections,
+        )
+
     def test_reformat_variables_single(self):
         self.r._sections = [
             {
@@ -1280,6 +1494,34 @@ class Test(unittest.TestCase):
             self.r._sections,
         )
 
+    def test_reformat_variables_remove_envvar_directives(self):
+        self.r._sections = [
+            {'lines': ['# .. envvar:: role_name__1', '',
+                       '# Comment 1.', '# .. envvar:: role_name__1', "role_name__1: 'test 1'",
+                       '# .. envvar:: role_name__2', "role_name__2: 'test 2'"]}
+        ]
+        self.r._reformat_variables(self.r._sections)
+
+        pprint.pprint(self.r._sections)
+        assert_equal(
+            [{'lines': ['']},
+             {'fold_name': '.. envvar:: role_name__1',
+              'lines': ['# Comment 1.', "role_name__1: 'test 1'"]},
+             {'fold_name': '.. envvar:: role_name__2',
+              'lines': ["role_name__2: 'test 2'"]}],
+            self.r._sections,
+        )
+
+    def test_get_variable_boundaries(self):
+        lines = [
+            '---', '', '# Comment 1.', '#', 'role_name__1:', '  - item', '',
+            '  - item', '# Comment 2.', 'role_name__2: 2',
+        ]
+        comment_starts, next_entries = self.r._get_variable_boundaries(lines, tokenize_lines(lines))
+
+        assert_equal([0, 1, 2, 2, 2, 5, 6, 7, 8, 8], comment_starts)
+        assert_equal([2, 2, 3, 4, 8, 8, 8, 8, 9, None], next_entries)
+
     def test_reformat_vars(self):
         self.r._lines = textwrap.dedent("""
             role_name__1: 'test 1'
@@ -2159,6 +2401,21 @@ class Test(unittest.TestCase):
         assert_equal(True, self.r._check_ends_with_yaml_block(lines[:-1]))
         assert_equal(True, self.r._check_ends_with_yaml_block(lines))
 
+    def test_yaml_block_state_feed_incrementally(self):
+        lines = textwrap.dedent('''
+            role_name__1: |
+              Some text
+            # ]]]
+            role_name__2: 'value'
+            role_name__3: |
+              Some text
+        ''').strip().split('\n')
+        for split_ind in range(len(lines) + 1):
+            state = _YamlBlockState()
+            state.feed(lines[:split_ind])
+            assert_equal(self.r._check_ends_with_yaml_block(lines), state.feed(lines[split_ind:]))
+            assert_equal(True, state.yaml_block)
+
     def test_check_ends_with_yaml_block_complex(self):
         lines = textwrap.dedent('''
             # .. envvar:: tinc__persistent_paths__dependent_paths [[[
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from nose.tools import assert_equal, assert_not_equal, assert_raises, assert_true
+
+from yaml4rst.section import Section
+
+
+def test_mapping_interface():
+    section = Section(lines=['role_name__1: []'])
+    assert_equal({'lines': ['role_name__1: []']}, section)
+    assert_equal(section, {'lines': ['role_name__1: []']})
+    assert_not_equal({'lines': [], 'fold_name': 'test'}, section)
+    assert_true('lines' in section)
+    assert_true('fold_name' not in section)
+    assert_true('unknown' not in section)
+    assert_equal(None, section.get('fold_name'))
+    assert_equal('', section.get('fold_name', ''))
+    assert_raises(KeyError, section.__getitem__, 'fold_name')
+
+    section['fold_name'] = 'test'
+    assert_equal('test', section['fold_name'])
+    assert_equal('test', section.pop('fold_name'))
+    assert_equal(None, section.pop('fold_name', None))
+    assert_equal([], section.setdefault('subsections', []))
+    section.update({'section_level': None})
+    assert_equal(['lines', 'subsections', 'section_level'], list(section))
+    assert_equal("{'lines': ['role_name__1: []'], 'subsections': [], 'section_level': None}", repr(section))
+    assert_raises(KeyError, section.__setitem__, 'unknown', None)
+
+
+def test_from_mapping():
+    section = Section.from_mapping({
+        'fold_name': 'test',
+        'subsections': [{'lines': ['role_name__1: []']}],
+    })
+    assert_true(isinstance(section['subsections'][0], Section))
+    assert_true(section is Section.from_mapping(section))
+
+
+def test_split():
+    lines = ['# Comment', 'role_name__1: []', 'role_name__2: []']
+    subsections = [Section(lines=['role_name__3: []'])]
+    section = Section(lines=lines, fold_name='test', section_level=1, subsections=subsections)
+
+    new_section = section.split(2)
+    assert_equal({'lines': ['# Comment', 'role_name__1: []'], 'fold_name': 'test', 'section_level': 1}, section)
+    assert_equal({'lines': ['role_name__2: []'], 'section_level': 1, 'subsections': subsections}, new_section)
+    assert_true(section['lines'] is lines)
+    assert_true(new_section['subsections'] is subsections)
+
+    new_section = section.split(1, move_subsections=False)
+    section.insert_subsection(0, new_section)
+    assert_equal(
+        {
+            'lines': ['# Comment'],
+            'fold_name': 'test',
+            'section_level': 1,
+            'subsections': [{'lines': ['role_name__1: []'], 'section_level': 1}],
+        },
+        section,
+    )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+
+from nose.tools import assert_equal, assert_in
+
+from yaml4rst.reformatter import YamlRstReformatter
+from yaml4rst.stats import ReformatStats
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_merge():
+    stats = ReformatStats()
+    stats.files = 1
+    stats.add('stage_1', 0.5, 10, 2)
+    stats.add('stage_2', 1.5, 12, 3)
+
+    other_stats = ReformatStats()
+    other_stats.files = 2
+    other_stats.add('stage_1', 1.0, 20, 4)
+    other_stats.add('stage_3', 0.25, 20, 4)
+
+    stats.merge(pickle.loads(pickle.dumps(other_stats)))
+    assert_equal(3, stats.files)
+    assert_equal(['stage_1', 'stage_2', 'stage_3'], list(stats.stages))
+    assert_equal(2, stats.stages['stage_1'].runs)
+    assert_equal(1.5, stats.stages['stage_1'].time)
+    assert_equal(1.0, stats.stages['stage_1'].max_time)
+    assert_equal(30, stats.stages['stage_1'].lines)
+    assert_equal(6, stats.stages['stage_1'].sections)
+    assert_equal(3.25, stats.get_total_time())
+
+    table = stats.get_table().split('\n')
+    assert_equal(5, len(table))
+    assert_in('stage_1', table[1])
+    assert_in('total (3 files)', table[-1])
+
+
+def test_reformatter_profile():
+    reformatter = YamlRstReformatter(
+        config={'ansible_full_role_name': 'debops.apt_install'},
+        profile=True,
+    )
+    reformatter.read_file(os.path.join(TESTS_DIR, 'input_files', 'debops.apt_install.yml'))
+    reformatter.reformat()
+
+    assert_equal(1, reformatter.stats.files)
+    assert_equal(
+        [
+            'read_file', 'validate_input', 'check_folds', 'check_formatted', 'get_sections_for_lines',
+            'reformat_legacy_rst_sections', 'reformat_variables', 'sort_section_levels',
+            'set_section_levels', 'sort_section_levels_equal', 'add_fixmes',
+            'get_lines_from_sections', 'update_header', 'remove_needless_newlines',
+            'check_var_names', 'check_output_folds', 'validate_output',
+        ],
+        list(reformatter.stats.stages),
+    )
+    stage_stats = reformatter.stats.stages['remove_needless_newlines']
+    assert_equal(1, stage_stats.runs)
+    assert_equal(len(reformatter._lines), stage_stats.lines)
+    assert_equal(0, reformatter.stats.stages['check_folds'].sections)
+    assert_equal(True, reformatter.stats.stages['reformat_variables'].sections > 0)
+
+
+def test_reformatter_no_profile():
+    assert_equal(None, YamlRstReformatter().stats)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from io import BytesIO
+
+from nose.tools import assert_equal, assert_raises
+
+from yaml4rst.stream import iter_documents
+
+
+def test_iter_documents():
+    assert_equal([b'a: 1\n', b'', b'b: 2\n'], list(iter_documents(BytesIO(b'a: 1\n\0\0b: 2\n\0'))))
+    assert_equal([b'a: 1\n', b'b: 2'], list(iter_documents(BytesIO(b'a: 1\n\0b: 2'))))
+    assert_equal([], list(iter_documents(BytesIO(b''))))
+
+
+def test_iter_documents_delimiter_across_chunks():
+    assert_equal(
+        [b'a: 1\n', b'b: 2\n', b'c: 3\n'],
+        list(iter_documents(BytesIO(b'a: 1\n...\nb: 2\n...\nc: 3\n...\n'), delimiter=b'...\n', chunk_size=3)),
+    )
+
+
+def test_iter_documents_empty_delimiter():
+    assert_raises(ValueError, list, iter_documents(BytesIO(b'a: 1\n'), delimiter=b''))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from nose.tools import assert_equal, assert_raises_regexp
+
+from yaml4rst.tokenizer import (
+    LineToken, tokenize_line, tokenize_lines,
+    KIND_BLANK, KIND_FOLD_OPEN, KIND_FOLD_CLOSE, KIND_HEADING_CHARS,
+    KIND_VARIABLE, KIND_COMMENT, KIND_OTHER,
+)
+
+
+def test_tokenize_line_folds():
+    assert_equal(
+        LineToken(KIND_FOLD_OPEN, 1, '.. envvar:: role_name__1', None, '.. envvar:: role_name__1 [[[', None, True),
+        tokenize_line('# .. envvar:: role_name__1 [[['),
+    )
+    assert_equal(
+        LineToken(KIND_FOLD_OPEN, 1, '', '[', '[[[', None, False),
+        tokenize_line('# [[['),
+    )
+    assert_equal(
+        LineToken(KIND_FOLD_CLOSE, -1, None, ']', ']]]', None, False),
+        tokenize_line('# ]]]'),
+    )
+    assert_equal(
+        LineToken(KIND_FOLD_CLOSE, -1, None, None, ']]]', None, False),
+        tokenize_line('                                                                   # ]]]'),
+    )
+
+
+def test_tokenize_line_fold_marker_not_at_end():
+    assert_equal(
+        LineToken(KIND_COMMENT, 0, None, None, '[[[ section', None, False),
+        tokenize_line('# [[[ section'),
+    )
+    assert_equal(
+        LineToken(KIND_COMMENT, 0, None, None, ']]] 1', None, False),
+        tokenize_line('# ]]] 1'),
+    )
+    assert_equal(
+        LineToken(KIND_FOLD_CLOSE, -1, None, ']', '..' + ' ' * 100 + ']]]', None, False),
+        tokenize_line('#' + ' ' * 100 + '..' + ' ' * 100 + ']]]'),
+    )
+    assert_equal(
+        LineToken(KIND_OTHER, 0, None, None, None, None, False),
+        tokenize_line('  - item: [[[1]]]'),
+    )
+
+
+def test_tokenize_line_explicit_fold_level():
+    assert_raises_regexp(
+        NotImplementedError,
+        r"^Found explicit fold level\. See under known limitations in the docs\.$",
+        tokenize_line,
+        '# section [[[23',
+    )
+
+
+def test_tokenize_lines():
+    assert_equal(
+        [
+            LineToken(KIND_COMMENT, 0, None, None, 'Section', None, False),
+            LineToken(KIND_HEADING_CHARS, 0, None, '=', '=======', None, False),
+            LineToken(KIND_BLANK, 0, None, None, None, None, False),
+            LineToken(KIND_COMMENT, 0, None, None, '.. envvar:: role_name__1', None, True),
+            LineToken(KIND_COMMENT, 0, None, None, None, None, False),
+            LineToken(KIND_VARIABLE, 0, None, None, None, 'role_name__1', False),
+            LineToken(KIND_OTHER, 0, None, None, 'comment', None, False),
+        ],
+        tokenize_lines([
+            '# Section',
+            '# =======',
+            '',
+            '# .. envvar:: role_name__1',
+            '#',
+            'role_name__1: |',
+            '  test # comment',
+        ]),
+    )
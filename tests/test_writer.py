@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import stat
+import threading
+import unittest
+
+from nose.tools import assert_equal, assert_raises
+from testfixtures import TempDirectory
+
+from yaml4rst.writer import OutputWriter
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write(self):
+        output_file = self.tmp_dir.getpath('main.yml')
+        old_umask = os.umask(0o027)
+        try:
+            OutputWriter().write(output_file, '---\n# New\n')
+        finally:
+            os.umask(old_umask)
+        assert_equal(b'---\n# New\n', self.tmp_dir.read('main.yml'))
+        assert_equal(0o640, stat.S_IMODE(os.stat(output_file).st_mode))
+
+        os.chmod(output_file, 0o604)
+        OutputWriter().write(output_file, '---\n# Changed\n')
+        assert_equal(b'---\n# Changed\n', self.tmp_dir.read('main.yml'))
+        assert_equal(0o604, stat.S_IMODE(os.stat(output_file).st_mode))
+
+        # No temporary files are left behind.
+        assert_equal(['main.yml'], os.listdir(self.tmp_dir.path))
+
+    def test_write_symlink(self):
+        self.tmp_dir.write('target.yml', b'---\n')
+        link_file = self.tmp_dir.getpath('link.yml')
+        os.symlink('target.yml', link_file)
+
+        OutputWriter().write(link_file, '---\n# Changed\n')
+        assert_equal(True, os.path.islink(link_file))
+        assert_equal(b'---\n# Changed\n', self.tmp_dir.read('target.yml'))
+
+    def test_write_not_regular_file(self):
+        for fsync in ['never', 'file', 'batch']:
+            writer = OutputWriter(fsync)
+            writer.write(os.devnull, '---\n')
+            assert_equal(True, stat.S_ISCHR(os.stat(os.devnull).st_mode))
+            assert_equal([], writer.pending_paths)
+
+        fifo_file = self.tmp_dir.getpath('fifo')
+        os.mkfifo(fifo_file)
+        fifo_content = []
+
+        def read_fifo():
+            with open(fifo_file, 'rb') as fifo_fh:
+                fifo_content.append(fifo_fh.read())
+
+        reader = threading.Thread(target=read_fifo)
+        reader.start()
+        OutputWriter().write(fifo_file, '---\n# FIFO\n')
+        reader.join()
+        assert_equal([b'---\n# FIFO\n'], fifo_content)
+        assert_equal(True, stat.S_ISFIFO(os.stat(fifo_file).st_mode))
+        assert_equal(['fifo'], os.listdir(self.tmp_dir.path))
+
+    def test_fsync(self):
+        output_file = self.tmp_dir.getpath('main.yml')
+
+        writer = OutputWriter('file')
+        writer.write(output_file, '---\n')
+        assert_equal([], writer.pending_paths)
+
+        writer = OutputWriter('batch')
+        worker_writer = pickle.loads(pickle.dumps(OutputWriter('batch')))
+        worker_writer.write(output_file, '---\n')
+        writer.merge(worker_writer)
+        assert_equal([os.path.realpath(output_file)], writer.pending_paths)
+        assert_equal([], worker_writer.pending_paths)
+        writer.sync()
+        assert_equal([], writer.pending_paths)
+
+        with assert_raises(ValueError):
+            OutputWriter('always')
@@ -4,5 +4,25 @@
 Linting/reformatting Python package for YAML files documented with inline RST
 """
 
+import sys
+
 from ._meta import *      # pylint: disable=wildcard-import
-from .reformatter import * # pylint: disable=wildcard-import
+
+# The reformatter is imported on first access so that submodules like
+# yaml4rst.cli can be imported without loading it, refer to PEP 562.
+_REFORMATTER_NAMES = ['YamlRstReformatterError', 'YamlRstReformatter', 'YAML_RST_REFORMATTER_FEATURES']
+
+# "from yaml4rst import *" imports the reformatter like before.
+__all__ = list(_REFORMATTER_NAMES)
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _REFORMATTER_NAMES:
+            from . import reformatter
+            return getattr(reformatter, name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    def __dir__():
+        return sorted(list(globals()) + _REFORMATTER_NAMES)
+else:  # pragma: no cover
+    from .reformatter import * # pylint: disable=wildcard-import
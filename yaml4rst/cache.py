@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk result cache of yaml4rst
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+__all__ = ['ResultCache']
+
+LOG = logging.getLogger(__name__)
+
+
+class ResultCache(object):
+    """Cache remembering input files which are already formatted.
+
+    Entries are keyed by the hash of the file content combined with the
+    settings digest of the reformatter which includes the preset, the template
+    contents, the effective configuration and the yaml4rst version.
+    Each entry stores the warnings which processing the file emitted so that
+    they can be repeated on a cache hit.
+
+    One file is used per entry so that multiple processes can use the same
+    cache directory without locking.
+    The cache directory also holds the Jinja2 bytecode cache of the templates.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    @staticmethod
+    def get_key(content, settings_digest):
+        """Return the cache key for the given file content (bytes) and reformatter settings."""
+        key_hash = hashlib.sha256(settings_digest.encode('utf-8'))
+        key_hash.update(content)
+        return key_hash.hexdigest()
+
+    def get_template_bytecode_cache_dir(self):
+        """Return the directory in which compiled templates can be cached."""
+        return os.path.join(self._cache_dir, 'templates')
+
+    def _get_entry_path(self, key):
+        return os.path.join(self._cache_dir, key[:2], key)
+
+    def get_warnings(self, key):
+        """Return the list of warnings for a file known to be formatted or None on a cache miss."""
+        try:
+            with open(self._get_entry_path(key), 'r', encoding='utf-8') as entry_fh:
+                return json.load(entry_fh)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_formatted(self, key, warnings):
+        """Remember that the file for the given key is already formatted."""
+        entry_path = self._get_entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            entry_fd, tmp_entry_path = tempfile.mkstemp(dir=entry_dir, prefix='.tmp')
+            with open(entry_fd, 'w', encoding='utf-8') as entry_fh:
+                json.dump(warnings, entry_fh)
+            os.replace(tmp_entry_path, entry_path)
+        except (IOError, OSError) as err:
+            LOG.debug("Could not write cache entry {}: {}".format(entry_path, err))
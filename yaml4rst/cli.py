@@ -9,16 +9,27 @@ from __future__ import absolute_import, division, print_function
 import logging
 import textwrap
 import argparse
+import functools
+import os
 import re
+import signal
 import sys
 import traceback
 
 from ._meta import __version__
-from .reformatter import YamlRstReformatter, YamlRstReformatterError, LOG
+from .stats import ReformatStats
 from .defaults import DEFAULTS
+from .writer import FSYNC_POLICIES, OutputWriter
+
+# The other modules of yaml4rst, PyYAML and multiprocessing are imported on
+# first use so that --version and argument errors do not pay for them and
+# --connect does not load the reformatter at all.
 
 __all__ = ['main']
 
+# Same as yaml4rst.reformatter.LOG.
+LOG = logging.getLogger('yaml4rst.reformatter')
+
 
 def parse_kv(vars_string):
     extra_vars = {}
@@ -37,6 +48,292 @@ def count_warning(*args, **kwargs):  # pylint: disable=unused-argument
     WARNING_COUNT += 1
 
 
+class _RecordCollector(logging.Handler):
+    """Logging handler which keeps log records for later use, for example to hand them back to the main process."""
+
+    def __init__(self, level=logging.NOTSET):
+        super(_RecordCollector, self).__init__(level=level)
+        self.records = []
+
+    def emit(self, record):
+        # Format the message now, the arguments might not be picklable.
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+_WORKER_RECORD_COLLECTOR = None
+
+
+def _init_worker(loglevel):
+    global _WORKER_RECORD_COLLECTOR  # pylint: disable=global-statement
+
+    # Warnings are counted by the main process in quiet mode.
+    LOG.__dict__.pop('warning', None)
+
+    _WORKER_RECORD_COLLECTOR = _RecordCollector()
+    package_log = logging.getLogger(LOG.name.split('.')[0])
+    package_log.setLevel(min(loglevel, logging.WARNING))
+    package_log.propagate = False
+    package_log.addHandler(_WORKER_RECORD_COLLECTOR)
+
+
+def _handle_worker_record(record):
+    if record.levelno == logging.WARNING and not LOG.isEnabledFor(logging.WARNING):
+        count_warning()
+        return
+
+    record_log = logging.getLogger(record.name)
+    if record_log.isEnabledFor(record.levelno):
+        record_log.handle(record)
+
+
+def _write_cached_output(input_content, output_file, only_if_changed, check, diff, writer):
+    if diff:
+        return ''
+    if check:
+        return False
+    output = input_content.decode('utf-8')
+    if output_file == '-':
+        return output
+    if not only_if_changed:
+        writer.write(output_file, output)
+    return False
+
+
+def reformat_file(
+        input_file, output_file, preset, config, only_if_changed=False, cache=None, stats=None,
+        check=False, diff=False, writer=None, input_content=None):
+    """Reformat the given input file and write it to the output file.
+
+    Whether the output differs from the input is returned,
+    or None if the input file could not be processed.
+    Output for STDOUT is returned instead of written so that the caller can
+    keep the output order deterministic.
+    In check mode, nothing is written and the output file is ignored.
+    Whether the input file would be changed is returned instead,
+    or None if it could not be processed.
+    In diff mode, the changes are returned as unified diff instead,
+    an empty string if there are none.
+    When a :class:`~yaml4rst.cache.ResultCache` is given, files known to be
+    already formatted are not processed again.
+    When a :class:`~yaml4rst.stats.ReformatStats` is given, the processing
+    stages are profiled and added to it.
+    Output files are written using the given
+    :class:`~yaml4rst.writer.OutputWriter` or a new one without fsync.
+    When the input content is given as bytes, it is reformatted instead of
+    reading the input file which is then only used in messages.
+    """
+
+    import yaml
+    from .reformatter import YamlRstReformatter, YamlRstReformatterError
+
+    if writer is None:
+        writer = OutputWriter()
+    reformatter = YamlRstReformatter(
+        preset=preset,
+        config=config,
+        template_bytecode_cache_dir=cache.get_template_bytecode_cache_dir() if cache is not None else None,
+        profile=stats is not None,
+    )
+
+    if input_content is None and input_file == '-':
+        input_content = sys.stdin.buffer.read()
+    cache_key = None
+    if cache is not None:
+        if input_content is None:
+            with open(input_file, 'rb') as input_fh:
+                input_content = input_fh.read()
+        cache_key = cache.get_key(input_content, reformatter.get_settings_digest())
+        cached_warnings = cache.get_warnings(cache_key)
+        if cached_warnings is not None:
+            LOG.debug("%s is already formatted according to the cache.", input_file)
+            for warning in cached_warnings:
+                LOG.warning(warning)
+            return _write_cached_output(input_content, output_file, only_if_changed, check, diff, writer)
+
+    warning_collector = _RecordCollector(level=logging.WARNING)
+    warning_count = WARNING_COUNT
+    LOG.addHandler(warning_collector)
+    try:
+        if input_content is None:
+            reformatter.read_file(input_file)
+        else:
+            reformatter.read_string(input_content.decode('utf-8'))
+        reformatter.reformat()
+
+        # Warnings can only be repeated from the cache when they have been recorded.
+        # In quiet mode, they are only counted.
+        if cache_key is not None and \
+                (LOG.isEnabledFor(logging.WARNING) or WARNING_COUNT == warning_count) and \
+                not reformatter.is_input_and_output_different() and \
+                (reformatter.get_content() + '\n').encode('utf-8') == input_content:
+            cache.set_formatted(cache_key, [record.msg for record in warning_collector.records])
+
+        if diff:
+            return reformatter.get_diff(from_file=input_file, to_file=input_file)
+        if check:
+            return reformatter.is_input_and_output_different()
+        if output_file == '-':
+            return reformatter.get_content() + '\n'
+        reformatter.write_file(
+            output_file,
+            only_if_changed=only_if_changed,
+            writer=writer,
+        )
+        return reformatter.is_input_and_output_different()
+    except YamlRstReformatterError as err:
+        LOG.debug(traceback.format_exc())
+        LOG.error("%s: %s", input_file, err)
+    except NotImplementedError as err:
+        LOG.debug(traceback.format_exc())
+        LOG.error("%s: %s", input_file, err)
+    except yaml.YAMLError as err:
+        LOG.debug(traceback.format_exc())
+        LOG.error("{} is not valid YAML: {}".format(input_file, err))
+    except UnicodeDecodeError as err:
+        LOG.debug(traceback.format_exc())
+        LOG.error("{} is not valid UTF-8: {}".format(input_file, err))
+    finally:
+        LOG.removeHandler(warning_collector)
+        if stats is not None:
+            stats.merge(reformatter.stats)
+
+    return None
+
+
+def reformat_file_via_daemon(
+        socket_path, input_file, output_file, preset, config, only_if_changed=False, stats=None,
+        check=False, diff=False, writer=None, input_content=None):
+    """Let the daemon listening on the given Unix socket path reformat the input file.
+
+    Behaves like :func:`reformat_file` otherwise. Profiling is not supported,
+    ``stats`` needs to be None.
+    """
+
+    from .daemon import request
+
+    # The input file is sent as absolute path, the diff uses it as given.
+    request_data = {'preset': preset, 'config': config, 'diff': diff, 'file_name': input_file}
+    if input_content is None and input_file == '-':
+        request_data['content'] = sys.stdin.read()
+    elif input_content is not None:
+        try:
+            request_data['content'] = input_content.decode('utf-8')
+        except UnicodeDecodeError as err:
+            LOG.error("{} is not valid UTF-8: {}".format(input_file, err))
+            return None
+    else:
+        request_data['input_file'] = os.path.abspath(input_file)
+
+    try:
+        response_data = request(socket_path, request_data)
+    except (IOError, OSError) as err:
+        LOG.error("Could not reach the daemon at {}: {}".format(socket_path, err))
+        return None
+    except ValueError as err:
+        # Empty or invalid response, for example when the daemon was stopped.
+        LOG.error("Invalid response of the daemon at {}: {}".format(socket_path, err))
+        return None
+
+    for warning in response_data['warnings']:
+        LOG.warning(warning)
+    if 'error' in response_data:
+        LOG.error("%s: %s", input_file, response_data['error'])
+        return None
+
+    if diff:
+        return response_data['diff']
+    if check:
+        return response_data['changed']
+    if output_file == '-':
+        return response_data['output']
+    if response_data['changed'] or not only_if_changed:
+        if writer is None:
+            writer = OutputWriter()
+        writer.write(output_file, response_data['output'])
+    else:
+        LOG.debug("Nothing to update.")
+
+    return response_data['changed']
+
+
+def reformat_stream(process_file, input_fh, output_fh, delimiter='\0', stats=None):
+    """Reformat the documents separated by the delimiter read from the binary input file object.
+
+    Each document is reformatted as soon as it has been read and written to
+    the binary output file object followed by the delimiter which is flushed
+    right away. Documents which could not be processed are written unchanged.
+    Returns the number of such documents.
+    """
+
+    from .stream import iter_documents
+
+    delimiter = delimiter.encode('utf-8')
+    failed_count = 0
+    for document_number, input_content in enumerate(iter_documents(input_fh, delimiter), start=1):
+        output = process_file(
+            'STDIN document {}'.format(document_number), '-', stats=stats, input_content=input_content,
+        )
+        if output is None:
+            failed_count += 1
+            output_fh.write(input_content)
+        else:
+            output_fh.write(output.encode('utf-8'))
+        output_fh.write(delimiter)
+        output_fh.flush()
+
+    return failed_count
+
+
+def _reformat_file_in_worker(process_file, profile, fsync, file_item):
+    _WORKER_RECORD_COLLECTOR.records = []
+    stats = ReformatStats() if profile else None
+    # Files pending synchronization are handed back to the main process.
+    writer = OutputWriter(fsync)
+    input_file, output_file, file_config, input_content = file_item
+    output = process_file(
+        input_file, output_file, config=file_config, stats=stats, writer=writer, input_content=input_content,
+    )
+    return input_file, _WORKER_RECORD_COLLECTOR.records, output, stats, writer
+
+
+def iter_files(input_files, output_files, config, include_patterns=None, exclude_patterns=None, onerror=None):
+    """Yield the input file, output file and configuration for each file to process.
+
+    Directories in ``input_files`` are searched for files to process, refer to
+    :func:`yaml4rst.discovery.iter_input_files`. Output files are taken from
+    ``output_files`` in input file order. If ``output_files`` is None, the
+    input files are edited in place. If it is False, no output files are
+    used.
+    If ``ansible_full_role_name`` is not configured, it is derived from the
+    Ansible role of each input file if possible.
+    ``onerror`` is called for directories which can not be read.
+    """
+
+    from .discovery import iter_input_files, get_ansible_full_role_name
+
+    if output_files:
+        output_files = iter(output_files)
+    for input_file in iter_input_files(input_files, include_patterns, exclude_patterns, onerror=onerror):
+        if output_files is None:
+            output_file = input_file
+        elif output_files is False:
+            output_file = None
+        else:
+            output_file = next(output_files)
+
+        file_config = config
+        if 'ansible_full_role_name' not in config and input_file != '-':
+            ansible_full_role_name = get_ansible_full_role_name(input_file)
+            if ansible_full_role_name is not None:
+                LOG.debug("Using ansible_full_role_name %s for %s", ansible_full_role_name, input_file)
+                file_config = dict(config, ansible_full_role_name=ansible_full_role_name)
+
+        yield input_file, output_file, file_config
+
+
 def get_args_parser():
     args_parser = argparse.ArgumentParser(
         description=textwrap.dedent("""
@@ -81,9 +378,13 @@ def get_args_parser():
     )
     args_parser.add_argument(
         'input_file',
-        help="One or more file paths to be processed."
-        " '-' will read from STDIN.",
-        nargs='+',
+        help="One or more file or directory paths to be processed."
+        " '-' will read from STDIN."
+        " Directories are searched recursively for files matching --include,"
+        " which requires --in-place, --check or --diff."
+        " The ansible_full_role_name is derived from the Ansible role of each file"
+        " unless it is given using --config-kv.",
+        nargs='*',
     )
     args_parser.add_argument(
         '-o', '--output-file',
@@ -96,10 +397,95 @@ def get_args_parser():
     )
     args_parser.add_argument(
         '-i', '--in-place',
-        help="Edit the input file(s) in place.",
+        help="Edit the input file(s) in place."
+        " Only files which are not already formatted are written."
+        " The number of changed files is written to STDERR at the end.",
+        action='store_true',
+        default=False,
+    )
+    args_parser.add_argument(
+        '--fsync',
+        help="When to synchronize written output files to the storage device."
+        " Output files are always replaced atomically using a temporary file in the same directory."
+        " 'never' leaves it to the operating system,"
+        " 'file' synchronizes each file before it replaces the previous file"
+        " and 'batch' synchronizes all written files at once at the end."
+        " Default: %(default)s.",
+        choices=FSYNC_POLICIES,
+        default='never',
+    )
+    args_parser.add_argument(
+        '--check',
+        help="Do not write any output but only check if the input files are already formatted."
+        " The paths of input files which would be changed by --in-place are written to STDOUT"
+        " followed by a summary on STDERR."
+        " Exits with 1 if any input file would be changed"
+        " and with 2 if any input file could not be processed.",
+        action='store_true',
+        default=False,
+    )
+    args_parser.add_argument(
+        '--diff',
+        help="Do not write the reformatted input files but the changes as unified diff to STDOUT."
+        " Can be combined with --check.",
+        action='store_true',
+        default=False,
+    )
+    args_parser.add_argument(
+        '--stream',
+        help="Read multiple documents from STDIN which are separated by --delimiter"
+        " and write each reformatted document followed by the delimiter to STDOUT as soon as it has been read."
+        " Documents which could not be processed are written unchanged."
+        " Exits with 2 if any document could not be processed."
+        " The documents are processed one after another.",
         action='store_true',
         default=False,
     )
+    args_parser.add_argument(
+        '--delimiter',
+        help="String separating the documents in --stream mode."
+        " Default: The NUL character.",
+        default='\0',
+    )
+    git_args_group = args_parser.add_mutually_exclusive_group()
+    git_args_group.add_argument(
+        '--changed-since',
+        help="Only process files which the git repository of the current working directory reports as changed"
+        " in the working tree compared to the given commit."
+        " Input files and directories limit the files to consider."
+        " Requires --in-place, --check or --diff.",
+        metavar='REF',
+    )
+    git_args_group.add_argument(
+        '--staged',
+        help="Only process files which are staged for the next commit"
+        " in the git repository of the current working directory."
+        " The staged content of the files is processed, not the working tree."
+        " With --in-place, files which also have unstaged changes are skipped."
+        " Useful for pre-commit hooks."
+        " Input files and directories limit the files to consider."
+        " Requires --in-place, --check or --diff.",
+        action='store_true',
+        default=False,
+    )
+    args_parser.add_argument(
+        '--include',
+        help="Shell pattern of files to process when searching directories or git changes."
+        " Patterns are matched against the path relative to the given directory"
+        " or the top level of the git repository and its trailing path components."
+        " Can be given multiple times."
+        " Default: {}.".format(', '.join(DEFAULTS['include_patterns'])),
+        action='append',
+        metavar='PATTERN',
+    )
+    args_parser.add_argument(
+        '--exclude',
+        help="Shell pattern of files and directories to skip when searching directories or git changes."
+        " Can be given multiple times."
+        " Default: {}.".format(', '.join(DEFAULTS['exclude_patterns'])),
+        action='append',
+        metavar='PATTERN',
+    )
     args_parser.add_argument(
         '-p', '--preset',
         help="Which preset to use."
@@ -112,10 +498,97 @@ def get_args_parser():
         " refer to the docs of yaml4rst for details.",
         action='append',
     )
+    args_parser.add_argument(
+        '-j', '--jobs',
+        help="Number of files to process in parallel."
+        " 0 will use one process per CPU."
+        " Default: %(default)s.",
+        type=int,
+        default=1,
+    )
+    args_parser.add_argument(
+        '-c', '--cache-dir',
+        help="Directory in which to remember files which are already formatted."
+        " Such files are skipped on subsequent runs as long as their content,"
+        " the preset, the templates, the configuration and the yaml4rst version are unchanged."
+        " Compiled templates are cached there as well."
+        " The cache is disabled by default.",
+    )
+    args_parser.add_argument(
+        '--profile',
+        help="Measure the wall time, line count and section count of each processing stage"
+        " and write a table summarizing all processed files to STDERR at the end.",
+        action='store_true',
+        default=False,
+    )
+    args_parser.add_argument(
+        '--serve',
+        help="Run as daemon which reformats files on request of clients"
+        " connecting to the given Unix socket path."
+        " Templates and modules are only loaded once for all requests.",
+        metavar='SOCKET_PATH',
+    )
+    args_parser.add_argument(
+        '--connect',
+        help="Let the daemon listening on the given Unix socket path reformat the input files."
+        " Refer to --serve.",
+        metavar='SOCKET_PATH',
+    )
 
     return args_parser
 
 
+def get_check_summary(check_counts, in_place=False):
+    """Return the summary of --check or --in-place for the given number of input files per change state."""
+
+    def files(count):
+        return '{} file{}'.format(count, '' if count == 1 else 's')
+
+    summary = "{} {}, {} already formatted.".format(
+        files(check_counts[True]),
+        'changed' if in_place else 'would be changed',
+        files(check_counts[False]),
+    )
+    if check_counts[None]:
+        summary += " {} could not be processed.".format(files(check_counts[None]))
+    return summary
+
+
+def get_cache(cache_dir):
+    """Return the :class:`~yaml4rst.cache.ResultCache` for the given directory or None if it is not set."""
+
+    if not cache_dir:
+        return None
+
+    from .cache import ResultCache
+
+    return ResultCache(cache_dir)
+
+
+def _exit_on_signal(signum, frame):  # pylint: disable=unused-argument
+    raise SystemExit(0)
+
+
+def serve(socket_path, loglevel):
+    from .daemon import YamlRstDaemon
+    from .reformatter import YamlRstReformatterError
+
+    try:
+        daemon = YamlRstDaemon(socket_path, loglevel=loglevel)
+    except (YamlRstReformatterError, IOError, OSError) as err:
+        LOG.error(err)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    LOG.info("Listening on {}".format(socket_path))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
 def main():
     if sys.version_info < (3, 3):  # pragma: no cover
         raise SystemExit("Only Python 3.3 or newer is supported. Exiting.")
@@ -130,40 +603,200 @@ def main():
         ),
         level=args.loglevel,
     )
+
+    if args.serve:
+        serve(args.serve, args.loglevel)
+        return
+
     if not LOG.isEnabledFor(logging.WARNING):
         LOG.warning = count_warning
 
-    if not args.in_place and len(args.input_file) != len(args.output_file):
+    git_mode = args.changed_since is not None or args.staged
+    if args.stream:
+        if args.input_file not in ([], ['-']) or git_mode or args.in_place or args.check or args.diff or \
+                args.output_file != ['-']:
+            args_parser.error(
+                "--stream can only read from STDIN and write to STDOUT and can not be used together with"
+                " --in-place, --check, --diff, --changed-since or --staged."
+            )
+        if not args.delimiter:
+            args_parser.error("--delimiter must not be empty.")
+        args.input_file = ['-']
+    if not args.input_file and not git_mode:
+        args_parser.error("At least one input file is required.")
+    if git_mode and '-' in args.input_file:
+        args_parser.error("STDIN can not be used together with --changed-since or --staged.")
+    input_dirs = [input_file for input_file in args.input_file if os.path.isdir(input_file)]
+    if (input_dirs or git_mode) and not (args.in_place or args.check or args.diff):
+        args_parser.error(
+            "Directories, --changed-since and --staged can only be used with --in-place, --check or --diff."
+        )
+    if args.check or args.diff:
+        if args.in_place or args.output_file != ['-']:
+            args_parser.error("--check and --diff can not be used together with --in-place or --output-file.")
+    elif not args.in_place and len(args.input_file) != len(args.output_file):
         args_parser.error(
             "The number of input files does not match the number of output files in non-in-place mode."
         )
 
-    for ind, input_file in enumerate(args.input_file):
-        reformatter = YamlRstReformatter(
+    config = parse_kv(', '.join(args.config_kv)) if args.config_kv else {}
+    if args.connect:
+        if args.cache_dir or args.profile:
+            args_parser.error("--cache-dir and --profile can not be used together with --connect.")
+        process_file = functools.partial(
+            reformat_file_via_daemon,
+            args.connect,
+            preset=args.preset,
+            config=config,
+            only_if_changed=args.in_place,
+            check=args.check,
+            diff=args.diff,
+        )
+    else:
+        process_file = functools.partial(
+            reformat_file,
             preset=args.preset,
-            config=parse_kv(', '.join(args.config_kv)) if args.config_kv else {},
+            config=config,
+            only_if_changed=args.in_place,
+            cache=get_cache(args.cache_dir),
+            check=args.check,
+            diff=args.diff,
         )
+    if args.check or args.diff:
+        output_files = False
+    elif args.in_place:
+        output_files = None
+    else:
+        output_files = args.output_file
+    input_files = args.input_file
+    # Content to process instead of reading the input file, per input file.
+    input_contents = {}
+    # Input files which are not processed at all.
+    skipped_count = 0
+    if git_mode:
+        from .discovery import iter_git_changed_files, read_git_staged_file
+        from .reformatter import YamlRstReformatterError
 
         try:
-            reformatter.read_file(input_file)
-            reformatter.reformat()
-
-            reformatter.write_file(
-                input_file if args.in_place else args.output_file[ind],
-                only_if_changed=args.in_place,
-            )
+            input_files = list(iter_git_changed_files(
+                args.input_file,
+                ref=args.changed_since,
+                staged=args.staged,
+                include_patterns=args.include,
+                exclude_patterns=args.exclude,
+            ))
+            if args.staged:
+                # What is going to be committed is checked, not the working tree.
+                for input_file in input_files:
+                    input_contents[input_file] = read_git_staged_file(input_file)
         except YamlRstReformatterError as err:
-            LOG.debug(traceback.format_exc())
-            LOG.error(err)
-        except NotImplementedError as err:
-            LOG.debug(traceback.format_exc())
             LOG.error(err)
+            sys.exit(2)
+
+        if args.staged and args.in_place:
+            # Reformatting the staged content in place would drop the unstaged changes.
+            for input_file in list(input_files):
+                with open(input_file, 'rb') as input_fh:
+                    if input_fh.read() == input_contents[input_file]:
+                        continue
+                LOG.error("{} has unstaged changes and is not edited in place.".format(input_file))
+                input_files.remove(input_file)
+                skipped_count += 1
+    # Number of input files per change state, see reformat_file.
+    # Directories which can not be read count as input files which could not be processed.
+    change_counts = {True: 0, False: 0, None: skipped_count}
+
+    def count_unreadable_dir(err):  # pylint: disable=unused-argument
+        change_counts[None] += 1
+
+    # Directories are searched while the files found so far are processed.
+    files = iter_files(input_files, output_files, config, args.include, args.exclude, onerror=count_unreadable_dir)
+    # STDIN is read here because worker processes can not read it.
+    if '-' in input_files and not args.stream:
+        input_contents['-'] = sys.stdin.buffer.read()
+    files = (
+        (input_file, output_file, file_config, input_contents.get(input_file))
+        for input_file, output_file, file_config in files
+    )
+
+    stats = ReformatStats() if args.profile else None
+    writer = OutputWriter(args.fsync)
+
+    def handle_output(input_file, output):
+        if isinstance(output, str) and not args.diff:
+            # Output for STDOUT.
+            sys.stdout.write(output)
+            return
+
+        # In diff mode, the output is the diff.
+        changed = None if output is None else bool(output)
+        change_counts[changed] += 1
+        if args.diff:
+            if output:
+                sys.stdout.write(output)
+        elif args.check and changed:
+            sys.stdout.write(input_file + '\n')
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    if git_mode or not input_dirs:
+        jobs = min(jobs, len(input_files))
+    if args.stream:
+        change_counts[None] = reformat_stream(
+            process_file, sys.stdin.buffer, sys.stdout.buffer, args.delimiter, stats=stats,
+        )
+    elif jobs <= 1:
+        for input_file, output_file, file_config, input_content in files:
+            output = process_file(
+                input_file, output_file, config=file_config, stats=stats, writer=writer, input_content=input_content,
+            )
+            handle_output(input_file, output)
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(
+            jobs,
+            initializer=_init_worker,
+            initargs=(args.loglevel,),
+        )
+        try:
+            # imap returns the results in input order which keeps the output deterministic.
+            results = pool.imap(
+                functools.partial(_reformat_file_in_worker, process_file, args.profile, args.fsync),
+                files,
+            )
+            for input_file, records, output, file_stats, file_writer in results:
+                for record in records:
+                    _handle_worker_record(record)
+                handle_output(input_file, output)
+                if file_stats is not None:
+                    stats.merge(file_stats)
+                writer.merge(file_writer)
+        finally:
+            # All results have been consumed at this point unless an exception occurred.
+            pool.terminate()
+            pool.join()
+
+    try:
+        writer.sync()
+    except (IOError, OSError) as err:
+        LOG.error("Could not synchronize the output files: {}".format(err))
+
+    if stats is not None:
+        sys.stderr.write(stats.get_table() + '\n')
 
     if args.warning_summary and WARNING_COUNT > 1:
         logging.error("You missed {} warnings in quiet mode!".format(
             WARNING_COUNT
         ))
 
+    if (args.check or args.in_place) and args.loglevel < logging.ERROR:
+        sys.stderr.write(get_check_summary(change_counts, in_place=args.in_place) + '\n')
+    if args.check or args.stream:
+        if change_counts[None]:
+            sys.exit(2)
+        if change_counts[True]:
+            sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reformatting daemon of yaml4rst listening on a Unix socket
+
+Starting yaml4rst for a single file is dominated by the Python startup, the
+imports and the template compilation. The daemon pays for this once and then
+reformats files on request, for example for editor save hooks or pre-commit
+hooks.
+
+The protocol is one JSON object per line. A client sends one request and
+reads one response per connection.
+
+Requests contain either ``input_file``, the path of a file which the daemon
+reads, or ``content``, the file content as string. Optional keys are
+``preset``, ``config``, ``diff`` and ``file_name``, the name of the input
+file to use in the ``diff``.
+
+Responses contain the reformatted ``output``, whether the output is
+``changed`` compared to the input and the emitted ``warnings``. If ``diff``
+was requested, the changes are included as unified ``diff`` as well. If the
+input could not be reformatted, ``error`` contains the error message instead
+of ``output``.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import traceback
+
+import yaml
+
+from .defaults import DEFAULTS
+from .reformatter import YamlRstReformatter, YamlRstReformatterError, LOG as REFORMATTER_LOG
+
+__all__ = ['YamlRstDaemon', 'request']
+
+LOG = logging.getLogger(__name__)
+
+
+class _RequestLogHandler(logging.Handler):
+    """Logging handler which collects the records emitted while processing one request."""
+
+    def __init__(self):
+        super(_RequestLogHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request_line = self.rfile.readline()
+        if not request_line.strip():
+            # Connection test without request, see _remove_stale_socket.
+            return
+
+        try:
+            request_data = json.loads(request_line.decode('utf-8'))
+        except ValueError as err:
+            response_data = {'error': "Invalid request: {}".format(err), 'warnings': []}
+        else:
+            try:
+                response_data = self.server.reformat(request_data)
+            except Exception as err:  # pylint: disable=broad-except
+                # The client always gets a response, the daemon keeps running.
+                LOG.error("Could not process request: %s", traceback.format_exc())
+                response_data = {'error': "Internal error of the daemon: {}".format(err), 'warnings': []}
+        self.wfile.write(json.dumps(response_data).encode('utf-8') + b'\n')
+
+
+class YamlRstDaemon(socketserver.UnixStreamServer):
+    """Server which reformats files on request of clients connecting to the given Unix socket path.
+
+    Requests are processed one after another in the process of the server so
+    that compiled templates and imported modules are reused.
+    Log records of the reformatter are collected per request. Warnings are
+    sent to the client, all records at or above ``loglevel`` are logged by the
+    daemon as well.
+    """
+
+    def __init__(self, socket_path, loglevel=logging.WARNING):
+        self.socket_path = socket_path
+        self._loglevel = loglevel
+        self._remove_stale_socket()
+
+        # Only the user running the daemon may connect to it.
+        old_umask = os.umask(0o077)
+        try:
+            super(YamlRstDaemon, self).__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        self._log_handler = _RequestLogHandler()
+        self._saved_log_settings = (REFORMATTER_LOG.level, REFORMATTER_LOG.propagate)
+        REFORMATTER_LOG.setLevel(min(loglevel, logging.WARNING))
+        REFORMATTER_LOG.propagate = False
+        REFORMATTER_LOG.addHandler(self._log_handler)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as test_socket:
+            try:
+                test_socket.connect(self.socket_path)
+            except (IOError, OSError):
+                LOG.info("Removing stale socket %s", self.socket_path)
+                os.unlink(self.socket_path)
+            else:
+                raise YamlRstReformatterError("A daemon is already listening on {}.".format(self.socket_path))
+
+    def server_close(self):
+        super(YamlRstDaemon, self).server_close()
+        REFORMATTER_LOG.removeHandler(self._log_handler)
+        REFORMATTER_LOG.setLevel(self._saved_log_settings[0])
+        REFORMATTER_LOG.propagate = self._saved_log_settings[1]
+        try:
+            os.unlink(self.socket_path)
+        except (IOError, OSError):
+            pass
+
+    def reformat(self, request_data):
+        """Process one request and return the response."""
+
+        self._log_handler.records = []
+        response_data = {}
+        try:
+            reformatter = YamlRstReformatter(
+                preset=request_data.get('preset', DEFAULTS['preset']),
+                config=request_data.get('config'),
+            )
+            if 'input_file' in request_data:
+                reformatter.read_file(request_data['input_file'])
+            else:
+                reformatter.read_string(request_data['content'])
+            reformatter.reformat()
+            response_data['output'] = reformatter.get_content() + '\n'
+            response_data['changed'] = reformatter.is_input_and_output_different()
+            if request_data.get('diff'):
+                file_name = request_data.get('file_name', request_data.get('input_file', '-'))
+                response_data['diff'] = reformatter.get_diff(from_file=file_name, to_file=file_name)
+        except (YamlRstReformatterError, NotImplementedError, yaml.YAMLError, IOError, OSError, KeyError,
+                ValueError) as err:
+            # ValueError: UnicodeDecodeError for input files which are not valid UTF-8.
+            REFORMATTER_LOG.debug(traceback.format_exc())
+            response_data['error'] = str(err)
+
+        for record in self._log_handler.records:
+            if record.levelno >= self._loglevel:
+                logging.getLogger().handle(record)
+        response_data['warnings'] = [
+            record.getMessage() for record in self._log_handler.records if record.levelno == logging.WARNING
+        ]
+
+        return response_data
+
+
+def request(socket_path, request_data):
+    """Send the request to the daemon listening on the given Unix socket path and return its response."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.connect(socket_path)
+        client_socket.sendall(json.dumps(request_data).encode('utf-8') + b'\n')
+        client_socket.shutdown(socket.SHUT_WR)
+
+        response_chunks = []
+        while True:
+            chunk = client_socket.recv(65536)
+            if not chunk:
+                break
+            response_chunks.append(chunk)
+
+    return json.loads(b''.join(response_chunks).decode('utf-8'))
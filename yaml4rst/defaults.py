@@ -24,4 +24,9 @@ DEFAULTS = {
         'top_level_section_suffix': '',
         'header_include_rst_file': '',
     },
+    # Files which are processed when searching directories,
+    # the default variables of Ansible roles.
+    'include_patterns': ['defaults/main.yml'],
+    # Files and directories which are skipped when searching directories.
+    'exclude_patterns': ['.*'],
 }
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+Discovery of input files in directories, Ansible role trees and git repositories
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import fnmatch
+import logging
+import os
+import subprocess
+
+import yaml
+
+from .defaults import DEFAULTS
+from .helpers import YAML_VALIDATION_LOADER
+from .reformatter import YamlRstReformatterError
+
+__all__ = ['iter_input_files', 'iter_git_changed_files', 'read_git_staged_file', 'get_ansible_full_role_name']
+
+LOG = logging.getLogger(__name__)
+
+# Subdirectories of which at least one needs to exist next to the defaults
+# directory of an Ansible role.
+_ROLE_DIRS = ['tasks', 'meta', 'handlers']
+
+
+def _matches(rel_path, patterns):
+    """Return True if one of the shell patterns matches the relative path or its trailing path components."""
+    return any(
+        fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(rel_path, '*/' + pattern)
+        for pattern in patterns
+    )
+
+
+def iter_input_files(paths, include_patterns=None, exclude_patterns=None, onerror=None):
+    """Yield the given file paths and the files found in the given directories.
+
+    Directories are searched recursively using :func:`os.scandir` and files
+    are yielded as soon as they are found so that they can be processed while
+    the search continues. A file is yielded if its path relative to the given
+    directory matches one of ``include_patterns`` and none of
+    ``exclude_patterns``. Patterns are shell patterns which can also match
+    only the trailing path components, ``defaults/main.yml`` matches
+    ``roles/apt/defaults/main.yml`` for example. Matching directories are
+    skipped. Symbolic links to directories are not followed.
+    Directories which can not be read are logged as error and skipped. The
+    :class:`OSError` is passed to ``onerror`` if given, like :func:`os.walk`
+    does.
+    """
+
+    if include_patterns is None:
+        include_patterns = DEFAULTS['include_patterns']
+    if exclude_patterns is None:
+        exclude_patterns = DEFAULTS['exclude_patterns']
+
+    for path in paths:
+        if path == '-' or not os.path.isdir(path):
+            yield path
+            continue
+
+        # Depth first in sorted order so that the output is deterministic.
+        dir_stack = [(path, '')]
+        while dir_stack:
+            dir_path, rel_dir_path = dir_stack.pop()
+            try:
+                with os.scandir(dir_path) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+            except OSError as err:
+                LOG.error("Could not read directory %s: %s", dir_path, err.strerror)
+                if onerror is not None:
+                    onerror(err)
+                continue
+
+            sub_dirs = []
+            for entry in entries:
+                rel_path = rel_dir_path + entry.name
+                if _matches(rel_path, exclude_patterns):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append((entry.path, rel_path + '/'))
+                elif entry.is_file() and _matches(rel_path, include_patterns):
+                    yield entry.path
+            dir_stack.extend(reversed(sub_dirs))
+
+
+def _run_git(git_args, decode=True):
+    try:
+        stdout = subprocess.run(
+            ['git'] + git_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        ).stdout
+        return stdout.decode('utf-8') if decode else stdout
+    except subprocess.CalledProcessError as err:
+        raise YamlRstReformatterError("git {} failed: {}".format(
+            git_args[0],
+            err.stderr.decode('utf-8', 'replace').strip(),
+        ))
+    except (IOError, OSError) as err:
+        raise YamlRstReformatterError("Could not run git: {}".format(err))
+
+
+def iter_git_changed_files(paths=None, ref=None, staged=False, include_patterns=None, exclude_patterns=None):
+    """Yield the files which git reports as changed in the repository of the current working directory.
+
+    With ``staged``, the files changed in the index compared to ``HEAD`` or
+    ``ref`` are yielded. Without commits, ``HEAD`` is the empty tree. Otherwise, the files changed in the working tree
+    compared to ``ref`` are yielded. Deleted files are skipped. The staged
+    content of the files can be read using :func:`read_git_staged_file`.
+    Only the local repository is queried using git plumbing. The environment
+    is passed on to git so that this also works in git hooks which use
+    a temporary index.
+    ``paths`` limit the files to the given files and directories.
+    ``include_patterns`` and ``exclude_patterns`` are matched against the
+    path relative to the top level of the repository, refer to
+    :func:`iter_input_files`.
+    The yielded paths are relative to the current working directory.
+    """
+
+    if include_patterns is None:
+        include_patterns = DEFAULTS['include_patterns']
+    if exclude_patterns is None:
+        exclude_patterns = DEFAULTS['exclude_patterns']
+
+    git_args = ['diff-index', '--name-only', '-z', '--no-renames', '--diff-filter=d']
+    if staged:
+        git_args.append('--cached')
+    if ref is None:
+        ref = 'HEAD'
+        try:
+            _run_git(['rev-parse', '--verify', '--quiet', ref])
+        except YamlRstReformatterError:
+            # No commit yet, everything is compared to the empty tree.
+            ref = _run_git(['hash-object', '-t', 'tree', os.devnull]).rstrip('\n')
+    git_args.append(ref)
+    git_args.append('--')
+    git_args.extend(paths or [])
+
+    top_level_dir = _run_git(['rev-parse', '--show-toplevel']).rstrip('\n')
+    for rel_path in _run_git(git_args).split('\0'):
+        if not rel_path or not _matches(rel_path, include_patterns) or _matches(rel_path, exclude_patterns):
+            continue
+        file_path = os.path.relpath(os.path.join(top_level_dir, rel_path))
+        # Submodules and symbolic links to directories.
+        if os.path.isfile(file_path):
+            yield file_path
+
+
+def read_git_staged_file(file_path):
+    """Return the content of the given file in the index of the git repository as bytes."""
+    return _run_git(['cat-file', 'blob', ':./' + os.path.relpath(file_path)], decode=False)
+
+
+def get_ansible_full_role_name(file_path):
+    """Return the full name of the Ansible role of the given defaults file or None.
+
+    The file needs to be located in the ``defaults`` directory of a role.
+    If the name of the role directory has the form ``ROLE_OWNER.ROLE_NAME``,
+    it is used as is. Otherwise, the role owner is taken from
+    ``galaxy_info.namespace`` in :file:`meta/main.yml` of the role.
+    """
+
+    defaults_dir = os.path.dirname(os.path.abspath(file_path))
+    if os.path.basename(defaults_dir) != 'defaults':
+        return None
+    role_dir = os.path.dirname(defaults_dir)
+    if not any(os.path.isdir(os.path.join(role_dir, role_sub_dir)) for role_sub_dir in _ROLE_DIRS):
+        return None
+
+    role_dir_name = os.path.basename(os.path.realpath(role_dir))
+    if len(role_dir_name.split('.')) == 2:
+        return role_dir_name
+
+    try:
+        with open(os.path.join(role_dir, 'meta', 'main.yml'), 'r', encoding='utf-8') as meta_fh:
+            meta = yaml.load(meta_fh, Loader=YAML_VALIDATION_LOADER)
+    except (IOError, OSError, yaml.YAMLError) as err:
+        LOG.debug("Could not read the meta data of the role in %s: %s", role_dir, err)
+        return None
+
+    galaxy_info = meta.get('galaxy_info') if isinstance(meta, dict) else None
+    if not isinstance(galaxy_info, dict) or not galaxy_info.get('namespace'):
+        return None
+    return '{}.{}'.format(galaxy_info['namespace'], galaxy_info.get('role_name') or role_dir_name)
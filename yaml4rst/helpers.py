@@ -7,10 +7,24 @@ Helper functions of yaml4rst
 from __future__ import absolute_import, division, print_function
 
 import re
+import bisect
+import difflib
 import logging
+import collections
+
+import yaml
 
 LOG = logging.getLogger(__name__)
 
+# libyaml is considerably faster than the pure Python implementation but might
+# not be available.
+if hasattr(yaml, 'CSafeLoader'):
+    YAML_VALIDATION_LOADER = yaml.CSafeLoader
+    YAML_VALIDATION_BACKEND = 'libyaml'
+else:  # pragma: no cover
+    YAML_VALIDATION_LOADER = yaml.SafeLoader
+    YAML_VALIDATION_BACKEND = 'python'
+
 
 def list_index(input_list, elem, fallback=None):
     try:
@@ -31,19 +45,28 @@ def get_last_index(input_list, search_elems, fallback=None):
 
 
 def get_first_match(pattern, strings, ind_offset=None, limit_pattern=None, break_pattern=None, match=True):
+    # Patterns can be given as strings or compiled, for example the ones of
+    # yaml4rst.tokenizer. They are compiled once instead of looking them up in
+    # the cache of the re module for each string.
+    pattern = re.compile(pattern)
+    if limit_pattern is not None:
+        limit_pattern = re.compile(limit_pattern)
+    if break_pattern is not None:
+        break_pattern = re.compile(break_pattern)
+
     #  LOG.debug('search {} in {}'.format(pattern, strings))
     for string_ind, string in enumerate(strings):
         #  LOG.debug('string: {}'.format(string))
 
-        _re = re.search(pattern, string)
+        _re = pattern.search(string)
         if (_re is not None) == match:
             if ind_offset is not None:
                 return string_ind + ind_offset
             return _re
-        if limit_pattern is not None and not re.search(limit_pattern, string):
+        if limit_pattern is not None and not limit_pattern.search(string):
             #  LOG.debug("Limit pattern matched")
             return None
-        if break_pattern is not None and re.search(break_pattern, string):
+        if break_pattern is not None and break_pattern.search(string):
             return None
     return None
 
@@ -87,3 +110,147 @@ def strip_list(input_list):
         prev_state = state
 
     return stripped_list
+
+
+def validate_yaml(content):
+    """Check that the given string is a single valid YAML document.
+
+    The document is only composed into a node graph, no Python objects are
+    constructed from it.
+    Returns the name of the used backend, raises :exc:`yaml.YAMLError` for
+    invalid YAML.
+    """
+    yaml.compose(content, Loader=YAML_VALIDATION_LOADER)
+    return YAML_VALIDATION_BACKEND
+
+
+def get_unified_diff(from_lines, to_lines, from_file='', to_file='', context_line_count=3):
+    """Yield the unified diff of the given lists of lines as lines which end with a newline.
+
+    The format is the same as of :func:`difflib.unified_diff` but the lines
+    are matched by :func:`_get_diff_opcodes` which does not take quadratic
+    time for long files with changes all over the place.
+    """
+
+    opcodes = _get_diff_opcodes(from_lines, to_lines)
+    if all(opcode[0] == 'equal' for opcode in opcodes):
+        return
+
+    yield '--- {}\n'.format(from_file)
+    yield '+++ {}\n'.format(to_file)
+    for group in _get_grouped_opcodes(opcodes, context_line_count):
+        yield '@@ -{} +{} @@\n'.format(
+            _format_unified_diff_range(group[0][1], group[-1][2]),
+            _format_unified_diff_range(group[0][3], group[-1][4]),
+        )
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in from_lines[i1:i2]:
+                    yield ' ' + line + '\n'
+                continue
+            for line in from_lines[i1:i2]:
+                yield '-' + line + '\n'
+            for line in to_lines[j1:j2]:
+                yield '+' + line + '\n'
+
+
+def _get_diff_opcodes(from_lines, to_lines):
+    """Return the opcodes which turn from_lines into to_lines like :meth:`difflib.SequenceMatcher.get_opcodes`.
+
+    The runtime of :class:`difflib.SequenceMatcher` grows quadratically with
+    the number of lines in the worst case. Because of this, lines which occur
+    exactly once in both lists are matched first as anchors, in the same
+    order in both lists (patience diff). Only the ranges between anchors are
+    compared by :class:`difflib.SequenceMatcher`. Variable definitions are
+    unique so these ranges are short.
+    """
+
+    from_counts = collections.Counter(from_lines)
+    to_counts = collections.Counter(to_lines)
+    to_unique_inds = {line: ind for ind, line in enumerate(to_lines) if to_counts[line] == 1}
+    anchors = _get_longest_increasing_anchors([
+        (from_ind, to_unique_inds[line])
+        for from_ind, line in enumerate(from_lines)
+        if from_counts[line] == 1 and line in to_unique_inds
+    ])
+    anchors.append((len(from_lines), len(to_lines)))
+
+    opcodes = []
+
+    def add_opcode(tag, i1, i2, j1, j2):
+        if tag == 'equal' and opcodes and opcodes[-1][0] == 'equal':
+            i1, j1 = opcodes.pop()[1::2]
+        opcodes.append((tag, i1, i2, j1, j2))
+
+    from_start = to_start = 0
+    for from_ind, to_ind in anchors:
+        matcher = difflib.SequenceMatcher(None, from_lines[from_start:from_ind], to_lines[to_start:to_ind])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            add_opcode(tag, i1 + from_start, i2 + from_start, j1 + to_start, j2 + to_start)
+        if from_ind < len(from_lines):
+            add_opcode('equal', from_ind, from_ind + 1, to_ind, to_ind + 1)
+        from_start, to_start = from_ind + 1, to_ind + 1
+
+    return opcodes
+
+
+def _get_longest_increasing_anchors(anchors):
+    """Return the longest subsequence of the given index pairs in which the second indexes increase.
+
+    The pairs need to be sorted by their first index which is unique.
+    """
+
+    # Index of the last anchor of the longest subsequences found so far, by length.
+    tail_inds = []
+    tail_to_inds = []
+    prev_inds = []
+    for ind, (_, to_ind) in enumerate(anchors):
+        length = bisect.bisect_left(tail_to_inds, to_ind)
+        prev_inds.append(tail_inds[length - 1] if length else None)
+        if length == len(tail_inds):
+            tail_inds.append(ind)
+            tail_to_inds.append(to_ind)
+        else:
+            tail_inds[length] = ind
+            tail_to_inds[length] = to_ind
+
+    longest = []
+    ind = tail_inds[-1] if tail_inds else None
+    while ind is not None:
+        longest.append(anchors[ind])
+        ind = prev_inds[ind]
+    longest.reverse()
+    return longest
+
+
+def _get_grouped_opcodes(opcodes, context_line_count):
+    """Group the opcodes into hunks like :meth:`difflib.SequenceMatcher.get_grouped_opcodes`."""
+
+    opcodes = list(opcodes)
+    if opcodes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = tag, max(i1, i2 - context_line_count), i2, max(j1, j2 - context_line_count), j2
+    if opcodes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = tag, i1, min(i2, i1 + context_line_count), j1, min(j2, j1 + context_line_count)
+
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # Start a new hunk after a range without changes which is longer than the context.
+        if tag == 'equal' and i2 - i1 > 2 * context_line_count:
+            group.append((tag, i1, min(i2, i1 + context_line_count), j1, min(j2, j1 + context_line_count)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context_line_count), max(j1, j2 - context_line_count)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_unified_diff_range(start, stop):
+    length = stop - start
+    if length == 1:
+        return '{}'.format(start + 1)
+    if not length:
+        return '{},0'.format(start)
+    return '{},{}'.format(start + 1, length)
@@ -6,28 +6,37 @@ Reformatting class of yaml4rst
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+import json
 import logging
-import re
 import os
 import sys
 import textwrap
+import time
+from contextlib import contextmanager
 from copy import deepcopy
+from itertools import islice
 #  from distutils.util import strtobool
-import pprint
 
 #  if sys.version_info[0] == 2:  # pragma: no cover
 #      from io import open  # pylint: disable=redefined-builtin
 
 
-import yaml
 #  yaml.scan does not return YAML comments which is what we need here ;)
 #  Ref: https://buguroo.com/why-parser-generator-tools-are-mostly-useless-in-static-analysis
 
-import jinja2
+# Jinja2 and pprint are imported on first use, see _get_template_env and
+# _pformat. No template is rendered for files known to be formatted by the
+# cache or when the CLI only passes files on to the daemon.
 
 
+from ._meta import __version__
 from .defaults import DEFAULTS
-from .helpers import get_first_match, get_last_index, insert_list, strip_list
+from .section import Section
+from .stats import ReformatStats
+from .helpers import get_last_index, get_unified_diff, insert_list, strip_list, validate_yaml
+from .tokenizer import KIND_BLANK, KIND_COMMENT, RE_HEADING_CHARS, RE_NEWLINE, tokenize_line, tokenize_lines
+from .writer import OutputWriter
 
 __all__ = ['YamlRstReformatterError', 'YamlRstReformatter', 'YAML_RST_REFORMATTER_FEATURES']
 
@@ -35,10 +44,26 @@ __all__ = ['YamlRstReformatterError', 'YamlRstReformatter', 'YAML_RST_REFORMATTE
 #  if sys.version_info < (3, 3):  # pragma: no cover
 #      raise SystemExit("Only Python 3.3 or newer is supported. Exiting.")
 
-# Before making pprint calls in debug logging, LOG.isEnabledFor(logging.DEBUG)
+# Debug messages are passed as %-style format string with arguments so that
+# they are only formatted when debug logging is enabled. Sections can be big.
+# Before making _pformat calls in debug logging, LOG.isEnabledFor(logging.DEBUG)
 # should be checked for performance reasons.
 LOG = logging.getLogger(__name__)
 
+# Compiled templates and Jinja2 environments shared by all instances of the
+# process, see YamlRstReformatter._get_template.
+_TEMPLATE_CACHE = {}
+_TEMPLATE_ENVS = {}
+# Settings digests by template path, preset and config, see
+# YamlRstReformatter.get_settings_digest.
+_SETTINGS_DIGESTS = {}
+
+
+def _pformat(obj):
+    import pprint
+
+    return pprint.pformat(obj)
+
 
 class YamlRstReformatterError(Exception):
     """Exception which is thrown by YamlRstReformatter when a unrecoverable error occurred."""
@@ -62,6 +87,105 @@ YAML_RST_REFORMATTER_FEATURES = textwrap.dedent("""
 """).strip()
 
 
+class _SectionsFrame(object):
+    """State of one fold level while building the section tree."""
+
+    __slots__ = (
+        'inside_fold', 'fold_level', 'new_section', 'sections', 'subsections', 'open_token',
+        'line_count', 'content_start', 'content_end', 'last_ind', 'line_inds',
+    )
+
+    def __init__(self, inside_fold):
+        self.inside_fold = inside_fold
+        self.fold_level = 0
+        self.new_section = Section()
+        self.sections = []
+        self.subsections = []
+        self.open_token = None
+
+        # Lines of the current section. Tracked as range of the first and last
+        # non-empty line in the input. Explicit line indexes are only needed
+        # when lines in between do not belong to the section.
+        self.line_count = 0
+        self.content_start = None
+        self.content_end = None
+        self.last_ind = None
+        self.line_inds = None
+
+    def add_line(self, ind, line):
+        if self.content_start is not None and self.line_inds is None and ind != self.last_ind + 1:
+            self.line_inds = list(range(self.content_start, self.last_ind + 1))
+        if self.line_inds is not None:
+            self.line_inds.append(ind)
+        if line != '':
+            if self.content_start is None:
+                self.content_start = ind
+            self.content_end = ind + 1
+        self.line_count += 1
+        self.last_ind = ind
+
+    def has_content(self):
+        return self.content_start is not None
+
+    def pop_lines(self, input_lines):
+        """Return the lines of the current section without leading and trailing empty lines and reset them."""
+        if self.content_start is None:
+            lines = []
+        elif self.line_inds is None:
+            lines = input_lines[self.content_start:self.content_end]
+        else:
+            lines = [input_lines[line_ind] for line_ind in self.line_inds if line_ind < self.content_end]
+
+        self.line_count = 0
+        self.content_start = None
+        self.content_end = None
+        self.last_ind = None
+        self.line_inds = None
+        return lines
+
+    def get_sections(self, input_lines):
+        if not self.sections:
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug("return lines as they where passed: %s", input_lines)
+            return [Section(
+                lines=list(input_lines),
+            )]
+        return self.sections
+
+
+class _YamlBlockState(object):
+    """Whether the lines fed so far end in a YAML block like ``key: |``.
+
+    Lines can be fed in multiple steps so that growing lists of lines only
+    need to be looked at once.
+    """
+
+    __slots__ = ('yaml_block', 'start_leading_spaces')
+
+    def __init__(self):
+        self.yaml_block = False
+        self.start_leading_spaces = None
+
+    def feed(self, lines):
+        for line in lines:
+            if line in ['', '# ]]]']:
+                continue
+
+            leading_spaces = len(line) - len(line.lstrip(' '))
+
+            if self.yaml_block and leading_spaces < self.start_leading_spaces+2:
+                self.yaml_block = False
+
+            if line.endswith(': |'):
+                self.yaml_block = True
+                self.start_leading_spaces = leading_spaces
+            elif tokenize_line(line).var_name is not None:
+                self.yaml_block = False
+                self.start_leading_spaces = None
+
+        return self.yaml_block
+
+
 class YamlRstReformatter(object):
     __doc__ = textwrap.dedent("""
         YAML+RST linting/reformatting class with the following features:
@@ -71,9 +195,7 @@ class YamlRstReformatter(object):
         features=YAML_RST_REFORMATTER_FEATURES,
     )
 
-    _RE_HEADING_CHARS = re.compile(
-        r'^#\s(?P<heading_char>[^a-zA-Z0-9]){3,999}$',
-    )
+    _RE_HEADING_CHARS = RE_HEADING_CHARS
 
     _HEADER_END_LINES = {
         'debops/ansible': [
@@ -91,95 +213,302 @@ class YamlRstReformatter(object):
             preset=deepcopy(DEFAULTS['preset']),
             template_path=deepcopy(DEFAULTS['template_path']),
             config=None,
+            template_bytecode_cache_dir=None,
+            profile=False,
     ):
 
         self._preset = preset
         self._template_path = template_path
+        self._template_bytecode_cache_dir = template_bytecode_cache_dir
 
         self._config = deepcopy(DEFAULTS['config'])
         if config is not None:
             self._config.update(config)
         self._auto_complete_config()
 
-        self._original_lines = []
+        # The input is only kept as one string with normalized line endings
+        # and without trailing whitespace. The lines of the input are
+        # materialized only once, as initial self._lines.
+        self._original_content = ''
+        self._original_line_count = 0
+        self._original_lines_validated = False
         self._lines = []
+        # Copy of the lines, content and change state of the output of the
+        # last reformat run so that they are only determined once.
+        self._output = None
         self._sections = []
         self._section_levels = []
         self._var_names = set()
 
         self._last_line_fold_yaml_block = False
 
+        #: :class:`~yaml4rst.stats.ReformatStats` of the processing stages if
+        #: profiling was enabled, None otherwise.
+        self.stats = ReformatStats() if profile else None
+
+    @contextmanager
+    def _profile_stage(self, stage):
+        """Record the wall time of the wrapped stage and the line and section counts after it."""
+        if self.stats is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        yield
+        duration = time.perf_counter() - start
+
+        section_count = 0
+        sections = list(self._sections)
+        while sections:
+            section = sections.pop()
+            section_count += 1
+            sections.extend(section.get('subsections', []))
+
+        self.stats.add(stage, duration, len(self._lines), section_count)
+
     def read_file(self, input_file):
-        """Read the given input file path and save its content for later processing."""
+        """Read the given input file path and save its content for later processing.
+
+        ``-`` reads from STDIN.
+        """
+        if input_file == '-':
+            self._read(sys.stdin)
+            return
         with open(input_file, 'r') as file_fh:
-            self._original_lines = [l.rstrip() for l in file_fh]
-            self._lines = deepcopy(self._original_lines)
+            self._read(file_fh)
 
+    def read_string(self, content):
+        """Read the given string and save its content for later processing."""
+        # Split like a file opened in text mode with universal newlines.
+        lines = RE_NEWLINE.split(content) if '\r' in content else content.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        self._read(lines)
+
+    def read_lines(self, lines):
+        """Read the given lines and save them for later processing.
+
+        Line endings and trailing whitespace are removed like
+        :meth:`read_file` does. The given list is not modified.
+        """
+        self._read(lines)
+
+    def _read(self, input_lines):
+        if self.stats is not None:
+            self.stats.files += 1
+
+        with self._profile_stage('read_file'):
+            # Instances can be reused for multiple inputs.
+            self._output = None
+            self._original_lines_validated = False
+            self._sections = []
+            self._section_levels = []
+            self._var_names = set()
+            self._last_line_fold_yaml_block = False
+            self._lines = [l.rstrip() for l in input_lines]
+            self._original_content = self.get_content()
+            self._original_line_count = len(self._lines)
+
+        with self._profile_stage('validate_input'):
             # Since this parser is very rudimentary, we check at the beginning
             # if the file we got is even valid YAML.
-            yaml.safe_load(self.get_content())
+            self._validate_yaml(self._original_content)
+            self._original_lines_validated = True
+
+    @property
+    def _original_lines(self):
+        """Lines of the input, split again from the kept input string on each access."""
+        if not self._original_line_count:
+            return []
+        return self._original_content.split('\n')
+
+    def reformat_lines(self, lines):
+        """Reformat the given lines and return the reformatted lines."""
+        self.read_lines(lines)
+        self.reformat()
+        return list(self._lines)
+
+    def reformat_string(self, content):
+        """Reformat the given string and return the reformatted string.
+
+        The returned string ends with a newline like the files written by
+        :meth:`write_file`.
+        """
+        self.read_string(content)
+        self.reformat()
+        return self.get_content() + '\n'
+
+    def reformat_bytes(self, content, encoding='utf-8'):
+        """Reformat the given bytes and return the reformatted bytes using the given encoding."""
+        return self.reformat_string(content.decode(encoding)).encode(encoding)
+
+    def _get_output(self):
+        """Return the output of the last :meth:`reformat` run or None if the lines changed since then."""
+        # Comparing the copy of the lines is cheap as unchanged lines are the same objects.
+        if self._output is not None and self._output[0] == self._lines:
+            return self._output
+        return None
 
     def get_content(self):
         """Return one string containing all lines."""
+        output = self._get_output()
+        if output is not None:
+            return output[1]
         return '\n'.join(self._lines)
 
     def reformat(self):
         """Process (check/lint/reformat) the instance lines."""
-        self._check_folds()
-        _, self._sections = self._get_sections_for_lines(self._lines, 0, section_lines=[])
-        self._section_levels = list(reversed(self._section_levels))  # Reverse recursion
+        self._output = None
+        with self._profile_stage('check_folds'):
+            self._check_folds()
+        with self._profile_stage('check_formatted'):
+            is_formatted = self._is_formatted()
+        if is_formatted:
+            LOG.debug("Input is already formatted. Skipping the reformatting stages.")
+        else:
+            self._reformat_sections()
+
+        with self._profile_stage('check_var_names'):
+            self._check_var_names()
+
+        # Just to ensure that we did not make a mistake.
+        with self._profile_stage('check_output_folds'):
+            self._check_folds()
+        with self._profile_stage('validate_output'):
+            content = self.get_content()
+            changed = self._is_content_different(content)
+            if not self._original_lines_validated or changed:
+                self._validate_yaml(content)
+        self._output = (list(self._lines), content, changed)
+
+    def _reformat_sections(self):
+        with self._profile_stage('get_sections_for_lines'):
+            _, self._sections = self._get_sections_for_lines(self._lines)
+            self._section_levels = list(reversed(self._section_levels))  # Reverse recursion
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('sections after _get_sections_for_lines:\n{}'.format(
-                pprint.pformat(self._sections),
-            ))
-        self._reformat_legacy_rst_sections(self._sections)
-        self._reformat_variables(self._sections)
+            LOG.debug(
+                'sections after _get_sections_for_lines:\n%s',
+                _pformat(self._sections),
+            )
+        with self._profile_stage('reformat_legacy_rst_sections'):
+            self._reformat_legacy_rst_sections(self._sections)
+        with self._profile_stage('reformat_variables'):
+            self._reformat_variables(self._sections)
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('sections after _reformat_variables:\n{}'.format(
-                pprint.pformat(self._sections),
-            ))
-        self._sort_section_levels(self._sections)
+            LOG.debug(
+                'sections after _reformat_variables:\n%s',
+                _pformat(self._sections),
+            )
+        with self._profile_stage('sort_section_levels'):
+            self._sort_section_levels(self._sections)
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('sections after _sort_section_levels:\n{}'.format(
-                pprint.pformat(self._sections),
-            ))
-        self._set_section_levels(self._sections)
-        self._sort_section_levels_equal(self._sections)
+            LOG.debug(
+                'sections after _sort_section_levels:\n%s',
+                _pformat(self._sections),
+            )
+        with self._profile_stage('set_section_levels'):
+            self._set_section_levels(self._sections)
+        with self._profile_stage('sort_section_levels_equal'):
+            self._sort_section_levels_equal(self._sections)
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('sections after _sort_section_levels_equal:\n{}'.format(
-                pprint.pformat(self._sections),
-            ))
-        self._add_fixmes(self._sections)
-        self._lines = self._get_lines_from_sections(self._sections)
+            LOG.debug(
+                'sections after _sort_section_levels_equal:\n%s',
+                _pformat(self._sections),
+            )
+        with self._profile_stage('add_fixmes'):
+            self._add_fixmes(self._sections)
+        with self._profile_stage('get_lines_from_sections'):
+            self._lines = self._get_lines_from_sections(self._sections)
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('lines after _get_lines_from_sections:\n{}'.format(
-                pprint.pformat(self._lines),
-            ))
-        self._update_header()
-        self._remove_needless_newlines()
+            LOG.debug(
+                'lines after _get_lines_from_sections:\n%s',
+                _pformat(self._lines),
+            )
+        with self._profile_stage('update_header'):
+            self._update_header()
+        with self._profile_stage('remove_needless_newlines'):
+            self._remove_needless_newlines()
+
+    def _validate_yaml(self, content=None):
+        if content is None:
+            content = self.get_content()
+        backend = validate_yaml(content)
+        LOG.debug("Validated YAML using the %s backend.", backend)
+
+    def _is_content_different(self, content):
+        # The line count is compared first because it does not need the
+        # content. Comparing strings of different length is cheap as well,
+        # equal length strings are compared by memcmp which is faster than
+        # hashing both of them.
+        return len(self._lines) != self._original_line_count or content != self._original_content
 
-        self._check_var_names()
+    def is_input_and_output_different(self):
+        """Return True if the instance lines differ from the input, including added or removed lines.
 
-        # Just to ensure that we did not make a mistake.
-        self._check_folds()
-        yaml.safe_load(self.get_content())
+        The result is determined once by :meth:`reformat` and reused as long
+        as the lines are not changed afterwards.
+        """
+        output = self._get_output()
+        if output is not None:
+            return output[2]
+        return self._is_content_different(self.get_content())
 
-    def is_input_and_output_different(self):
-        for i, j in zip(self._original_lines, self._lines):
-            if i != j:
-                #  LOG.debug("{} != {}".format(i, j))
-                return True
-        return False
-
-    def write_file(self, output_file, only_if_changed=False):
-        """Write the instance lines to the given output file path and save its content for later processing."""
-        if output_file == '-':
-            sys.stdout.write(self.get_content() + '\n')
-        elif (only_if_changed and self.is_input_and_output_different()) or not only_if_changed:
-            with open(output_file, 'w', encoding='utf-8') as output_fh:
-                output_fh.write(self.get_content() + '\n')
-        else:
-            LOG.debug("Nothing to update.")
+    def get_diff(self, from_file='', to_file='', context_line_count=3):
+        """Return the changes of the instance lines compared to the input as unified diff.
+
+        An empty string is returned if nothing was changed.
+        """
+        if not self.is_input_and_output_different():
+            return ''
+        return ''.join(get_unified_diff(
+            self._original_lines,
+            self._lines,
+            from_file=from_file,
+            to_file=to_file,
+            context_line_count=context_line_count,
+        ))
+
+    def write_file(self, output_file, only_if_changed=False, writer=None):
+        """Write the instance lines to the given output file path and save its content for later processing.
+
+        The output file is replaced atomically by the given
+        :class:`~yaml4rst.writer.OutputWriter` or a new one without fsync.
+        """
+        with self._profile_stage('write_file'):
+            if output_file == '-':
+                sys.stdout.write(self.get_content() + '\n')
+            elif (only_if_changed and self.is_input_and_output_different()) or not only_if_changed:
+                if writer is None:
+                    writer = OutputWriter()
+                writer.write(output_file, self.get_content() + '\n')
+            else:
+                LOG.debug("Nothing to update.")
+
+    def get_settings_digest(self):
+        """Return a digest of all settings besides the input which influence the output.
+
+        The digest is determined once per process for the same template path,
+        preset and config, the template files are only read the first time.
+        """
+        settings_json = json.dumps(
+            [__version__, self._preset, self._config],
+            sort_keys=True,
+            default=str,
+        )
+        digest_key = (self._template_path, settings_json)
+        settings_digest = _SETTINGS_DIGESTS.get(digest_key)
+        if settings_digest is not None:
+            return settings_digest
+
+        settings_hash = hashlib.sha256(settings_json.encode('utf-8'))
+        template_dir_path = self._get_template_dir_path()
+        for template_file_name in sorted(os.listdir(template_dir_path)):
+            with open(os.path.join(template_dir_path, template_file_name), 'rb') as template_fh:
+                settings_hash.update(template_file_name.encode('utf-8'))
+                settings_hash.update(template_fh.read())
+
+        settings_digest = _SETTINGS_DIGESTS[digest_key] = settings_hash.hexdigest()
+        return settings_digest
 
     def _auto_complete_config(self):
         if 'ansible_full_role_name' in self._config:
@@ -201,20 +530,70 @@ class YamlRstReformatter(object):
                     )
                 )
 
-    def _get_rendered_template(self, template_name):
-        template_dir_path = os.path.abspath(os.path.join(
+    def _get_template_dir_path(self):
+        return os.path.abspath(os.path.join(
             self._template_path,
             self._preset,
         ))
-        template_loader = jinja2.FileSystemLoader(
-            searchpath=template_dir_path,
-        )
-        template_env = jinja2.Environment(
-            loader=template_loader,
-            undefined=jinja2.StrictUndefined,
-            trim_blocks=True,
-        )
-        template = template_env.get_template(template_name + '.j2')
+
+    def _get_template_env(self, template_dir_path):
+        env_key = (template_dir_path, self._template_bytecode_cache_dir)
+        template_env = _TEMPLATE_ENVS.get(env_key)
+        if template_env is None:
+            import jinja2
+
+            bytecode_cache = None
+            if self._template_bytecode_cache_dir is not None:
+                try:
+                    os.makedirs(self._template_bytecode_cache_dir, exist_ok=True)
+                    bytecode_cache = jinja2.FileSystemBytecodeCache(self._template_bytecode_cache_dir)
+                except OSError as err:
+                    LOG.debug(
+                        "Could not use template bytecode cache %s: %s",
+                        self._template_bytecode_cache_dir, err,
+                    )
+
+            template_env = _TEMPLATE_ENVS[env_key] = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(
+                    searchpath=template_dir_path,
+                ),
+                undefined=jinja2.StrictUndefined,
+                trim_blocks=True,
+                # Compiled templates are cached by _get_template.
+                cache_size=0,
+                bytecode_cache=bytecode_cache,
+            )
+        return template_env
+
+    def _get_template(self, template_name):
+        """Return the compiled template of the given name.
+
+        Compiled templates are cached for the whole process by template path,
+        preset and template name so that they are only compiled once for all
+        processed files. A template is compiled again when the modification
+        time of its file changes.
+        """
+
+        template_dir_path = self._get_template_dir_path()
+        template_file_name = template_name + '.j2'
+        cache_key = (self._template_path, self._preset, template_name)
+        try:
+            template_mtime = os.stat(os.path.join(template_dir_path, template_file_name)).st_mtime_ns
+        except OSError:
+            template_mtime = None
+
+        cached_template = _TEMPLATE_CACHE.get(cache_key)
+        if cached_template is not None and template_mtime is not None and cached_template[0] == template_mtime:
+            return cached_template[1]
+
+        template = self._get_template_env(template_dir_path).get_template(template_file_name)
+        _TEMPLATE_CACHE[cache_key] = (template_mtime, template)
+        return template
+
+    def _get_rendered_template(self, template_name):
+        import jinja2
+
+        template = self._get_template(template_name)
 
         try:
             rendered_template = template.render(self._config)
@@ -227,34 +606,18 @@ class YamlRstReformatter(object):
 
     @staticmethod
     def _get_line_fold(line):
-        return_dict = {
-            'change': 0,
-            'name': None,
-            'level': None,
+        token = tokenize_line(line)
+        return {
+            'change': token.fold_change,
+            'name': token.fold_name,
+            'level': '' if token.fold_change == +1 else None,
         }
 
-        _fold_open_re = re.search(r'^\s*#\s*(?P<fold_name>(?:\.{2})?\s*.*?)\s*[[({]{3}(?P<fold_level>\d*)$', line)
-        if _fold_open_re:
-            if _fold_open_re.group('fold_level') != '':
-                raise NotImplementedError(
-                    "Found explicit fold level. See under known limitations in the docs.")
-            return_dict = {
-                'change': +1,
-                'name': _fold_open_re.group('fold_name'),
-                'level': _fold_open_re.group('fold_level'),
-            }
-        elif re.search(r'^\s*#\s*(?:\.{2})?\s*[\])}]{3}$', line):
-            return_dict['change'] = -1
-
-        return return_dict
-
     def _check_folds(self, lines=None, fatal=True):
         if lines is None:
             lines = self._lines
 
-        fold_level = 0
-        for line in lines:
-            fold_level += self._get_line_fold(line)['change']
+        fold_level = sum(tokenize_line(line).fold_change for line in lines)
 
         msg = None
         if fold_level > 1:
@@ -305,119 +668,155 @@ class YamlRstReformatter(object):
                 lines.append(closing_fold_format_spec.format('# ]]]'))
             closing_folds = 0
 
-        LOG.debug('_get_closing_folds returns: {}'.format(lines))
+        LOG.debug('_get_closing_folds returns: %s', lines)
         return lines
 
-    def _get_sections_for_lines(self, input_lines, ind, section_lines=None, inside_fold=False):
-        LOG.debug('call input: {}'.format(input_lines))
-        LOG.debug('call ind: {}'.format(ind))
-        LOG.debug('call section_lines: {}'.format(section_lines))
+    def _get_sections_for_lines(self, input_lines, ind=0):
+        """Build the section tree for the given lines.
+
+        The tree is built in one pass over the fold tokens using an explicit
+        stack of :class:`_SectionsFrame` objects, one for each nested fold.
+        Section lines are tracked as index ranges into ``input_lines`` and only
+        copied once when the section is complete.
 
-        if section_lines is None:
-            section_lines = []
+        Returns the index at which processing stopped and the list of sections.
+        """
+
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('call input: %s', input_lines)
+            LOG.debug('call ind: %s', ind)
 
-        new_section = {}
-        sections = []
-        subsections = []
-        fold_level = 0
+        tokens = tokenize_lines(input_lines)
+        lines_count = len(input_lines)
+        frame = _SectionsFrame(inside_fold=False)
+        stack = []
         ind -= 1
         while True:
             ind += 1
-            if ind >= len(input_lines):
-                break
-            line = input_lines[ind]
-            LOG.debug("processing line: '{}'".format(line))
-
-            fold = self._get_line_fold(line)
-            fold_level += fold['change']
-            LOG.debug('ind: {}, fold: {}, fold change: {}, name: {}, inside: {}'.format(
-                ind,
-                fold_level,
-                fold['change'],
-                fold['name'],
-                inside_fold,
-            ))
+            if ind >= lines_count:
+                # End of input, all open frames are done.
+                if not stack:
+                    break
+                token = self._end_sections_frame(frame, stack, input_lines)
+                frame = stack.pop()
+            else:
+                line = input_lines[ind]
+                token = tokens[ind]
+                LOG.debug("processing line: '%s'", line)
 
-            if fold['change'] == 0:
-                if subsections and line != '':
-                    start_ind = ind
-                    while True:
-                        ind += 1
-                        if ind >= len(input_lines):
-                            break
-
-                        line = input_lines[ind]
-                        fold = self._get_line_fold(line)
-
-                        if fold['change'] != 0:
-                            break
-
-                    subsections.append({
-                        'lines': strip_list(input_lines[start_ind:ind]),
-                    })
-
-                    if fold['change'] != 0:
-                        ind -= 1
-
-                    continue  # pragma: no cover
-                    # Seems to be a known issue that coverage.py might fail with that:
-                    # https://bitbucket.org/ned/coveragepy/issues/496/incorrect-coverage-with-branching-and
-
-                section_lines.append(line)
-                LOG.debug('section_lines: {}'.format(section_lines))
-            elif fold['change'] == +1:
-                if 'fold_name' not in new_section and not strip_list(section_lines):
-                    new_section['fold_name'] = fold['name']
-
-            if fold_level > 1 and fold['change'] == +1:
-                fold_level -= 1
-                LOG.debug('sub: {} ({}), inside: {}'.format(ind, input_lines[ind], inside_fold))
-                ind, new_subsections = self._get_sections_for_lines(
-                    input_lines,
+                frame.fold_level += token.fold_change
+                LOG.debug(
+                    'ind: %s, fold: %s, fold change: %s, name: %s, inside: %s',
                     ind,
-                    section_lines=[],
-                    inside_fold=True
+                    frame.fold_level,
+                    token.fold_change,
+                    token.fold_name,
+                    frame.inside_fold,
                 )
-                try:
-                    LOG.debug('sub return: {} ({}), inside: {}'.format(ind, input_lines[ind], inside_fold))
-                except IndexError:  # pragma: no cover
-                    LOG.debug('sub return: {} ({}), inside: {}'.format(ind, 'eof', inside_fold))
-                subsections.extend(new_subsections)
-
-            eof = ind+1 not in range(len(input_lines))
-            if (fold['change'] == -1 and (section_lines or subsections) or
-                    fold['change'] == 1 and 'fold_name' not in new_section) or eof:
-                section_lines = strip_list(section_lines)
-                LOG.debug('section_lines (strip): {}'.format(section_lines))
-                if subsections:
-                    new_section['subsections'] = subsections
-                    subsections = []
-                if section_lines:
-                    _re_heading_chars = self._RE_HEADING_CHARS.search(section_lines[0])
-                    if 'fold_name' in new_section and _re_heading_chars:
-                        self._get_section_level(_re_heading_chars.group('heading_char'))
-                    new_section['lines'] = section_lines
-                    section_lines = []
-                sections.append(new_section)
-                LOG.debug('sections: {}'.format(sections))
-                new_section = {}
-                if fold['name'] is not None:
-                    new_section['fold_name'] = fold['name']
-                if inside_fold:
-                    break
 
-        if not sections:
-            LOG.debug("return lines as they where passed: {}".format(input_lines))
-            return ind, [{
-                'lines': input_lines,
-            }]
-        LOG.debug("return sections: {}".format(sections))
-        return ind, sections
+                if token.fold_change == 0:
+                    if frame.subsections and line != '':
+                        start_ind = ind
+                        while True:
+                            ind += 1
+                            if ind >= lines_count:
+                                break
+
+                            token = tokens[ind]
+
+                            if token.fold_change != 0:
+                                break
+
+                        frame.subsections.append(Section(
+                            lines=self._get_stripped_range(input_lines, start_ind, ind),
+                        ))
+
+                        if token.fold_change != 0:
+                            ind -= 1
+
+                        continue
+
+                    frame.add_line(ind, line)
+                elif token.fold_change == +1:
+                    if 'fold_name' not in frame.new_section and not frame.has_content():
+                        frame.new_section['fold_name'] = token.fold_name
+
+                if frame.fold_level > 1 and token.fold_change == +1:
+                    frame.fold_level -= 1
+                    LOG.debug('sub: %s (%s), inside: %s', ind, line, frame.inside_fold)
+                    # The nested fold starts processing at its opening line.
+                    frame.open_token = token
+                    stack.append(frame)
+                    frame = _SectionsFrame(inside_fold=True)
+                    ind -= 1
+                    continue
+
+            # Close the current section if needed. Ending a nested fold
+            # continues with the frame of the enclosing fold.
+            while self._close_section(frame, token, ind + 1 >= lines_count, input_lines):
+                token = self._end_sections_frame(frame, stack, input_lines)
+                frame = stack.pop()
+
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("return sections: %s", frame.sections)
+        return ind, frame.get_sections(input_lines)
+
+    @staticmethod
+    def _get_stripped_range(input_lines, start_ind, end_ind):
+        """Return the lines in the given range without leading and trailing empty lines."""
+        while start_ind < end_ind and input_lines[start_ind] == '':
+            start_ind += 1
+        while end_ind > start_ind and input_lines[end_ind - 1] == '':
+            end_ind -= 1
+        return input_lines[start_ind:end_ind]
+
+    @staticmethod
+    def _end_sections_frame(frame, stack, input_lines):
+        """Hand the sections of a nested fold over to the frame of the enclosing fold.
+
+        Returns the token which opened the nested fold.
+        """
+        parent_frame = stack[-1]
+        parent_frame.subsections.extend(frame.get_sections(input_lines))
+        LOG.debug('sub return, inside: %s', parent_frame.inside_fold)
+        return parent_frame.open_token
+
+    def _close_section(self, frame, token, eof, input_lines):
+        """Close the section of the frame after the given token if needed.
+
+        Returns True if the frame of a nested fold is done.
+        """
+        if not (token.fold_change == -1 and (frame.line_count or frame.subsections) or
+                token.fold_change == 1 and 'fold_name' not in frame.new_section or eof):
+            return False
+
+        new_section = frame.new_section
+        if frame.subsections:
+            new_section['subsections'] = frame.subsections
+            frame.subsections = []
+        section_lines = frame.pop_lines(input_lines)
+        LOG.debug('section_lines (strip): %s', section_lines)
+        if section_lines:
+            heading_char = tokenize_line(section_lines[0]).heading_char
+            if 'fold_name' in new_section and heading_char is not None:
+                self._get_section_level(heading_char)
+            new_section['lines'] = section_lines
+        frame.sections.append(new_section)
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('sections: %s', frame.sections)
+        frame.new_section = Section()
+        if token.fold_name is not None:
+            frame.new_section['fold_name'] = token.fold_name
+
+        return frame.inside_fold
 
     def _get_lines_from_sections(self, sections):
         lines = []
         closing_folds = 0
         opening_fold = ''
+        # Lines before checked_line_count have already been fed to yaml_block_state.
+        yaml_block_state = _YamlBlockState()
+        checked_line_count = 0
         for section in sections:
 
             if 'fold_name' in section:
@@ -431,12 +830,12 @@ class YamlRstReformatter(object):
                 section_lines = list(section['lines'])
                 if 'fold_name' in section:
                     if section_lines[0] != '#':
-                        _re = self._RE_HEADING_CHARS.search(section_lines[0])
+                        heading_char = tokenize_line(section_lines[0]).heading_char
                         if section['fold_name'].startswith('.. '):
                             lines.append('#')
-                        elif _re:
+                        elif heading_char is not None:
                             section_lines[0] = '# {}'.format(
-                                _re.group('heading_char') * (len(opening_fold) - 2),
+                                heading_char * (len(opening_fold) - 2),
                             )
                 lines.extend(strip_list(section_lines))
                 lines.append('')
@@ -445,16 +844,17 @@ class YamlRstReformatter(object):
                 lines.extend(self._get_lines_from_sections(section['subsections']))
 
             if closing_folds > 0:
-                LOG.debug("Writing {} closing folds".format(closing_folds))
-                self._last_line_fold_yaml_block = self._check_ends_with_yaml_block(lines)
-                LOG.debug('self._last_line_fold_yaml_block: {}'.format(self._last_line_fold_yaml_block))
+                LOG.debug("Writing %s closing folds", closing_folds)
+                self._last_line_fold_yaml_block = yaml_block_state.feed(lines[checked_line_count:])
+                checked_line_count = len(lines)
+                LOG.debug('self._last_line_fold_yaml_block: %s', self._last_line_fold_yaml_block)
                 lines.extend(self._get_closing_folds(
                     closing_folds,
                     self._last_line_fold_yaml_block,
                 ))
                 closing_folds = 0
 
-        LOG.debug("Returning lines:\n{}".format(lines))
+        LOG.debug("Returning lines:\n%s", lines)
         return lines
 
     def _add_fixmes(self, sections):
@@ -471,7 +871,7 @@ class YamlRstReformatter(object):
             found_comment = False
             last_comment_ind = None
             for ind, line in enumerate(section['lines']):
-                LOG.debug("Processing: {}, line: {}".format(ind, line))
+                LOG.debug("Processing: %s, line: %s", ind, line)
                 if not line.startswith('#'):
                     break
 
@@ -496,56 +896,67 @@ class YamlRstReformatter(object):
     def _remove_needless_newlines(self):
         """Remove needless newlines near closing folds in self._lines."""
 
-        state = 'before'
-        ind = -1
-        empty_lines_before = []
-        closing_folds = 0
-        while True:
-            ind += 1
-            try:
-                line = self._lines[ind]
-            except IndexError:
-                break
+        self._lines = list(self._iter_lines_without_needless_newlines(self._lines))
+
+    def _iter_lines_without_needless_newlines(self, lines):
+        """Yield the given lines without needless newlines near closing folds.
+
+        Empty lines after closing folds are dropped. An empty line followed
+        by indented lines before a closing fold is only kept when there are
+        not more closing folds than ``wanted_empty_lines_between_items``.
+        Lines are only held back until it is known whether such an empty line
+        is needed so that the output is built in one pass.
+        """
 
+        wanted_empty_line_count = int(self._config['wanted_empty_lines_between_items'])
+        lines = iter(lines)
+
+        # The last empty line and the indented lines following it.
+        held_lines = []
+        for line in lines:
             if not line.startswith(' '):
-                empty_lines_before = []
+                yield from held_lines
+                held_lines = []
 
             if line == '':
-                empty_lines_before.append(ind)
-            else:
-                fold = self._get_line_fold(line)
-                if fold['change'] == -1:
-                    closing_folds += 1
-                    state = 'in'
+                held_lines.append(line)
+                continue
+            elif tokenize_line(line).fold_change != -1:
+                if held_lines:
+                    held_lines.append(line)
+                else:
+                    yield line
+                continue
 
-            if state == 'in':
-                ind += 1
-                for _ in range(ind, len(self._lines)):
-                    fold = self._get_line_fold(self._lines[ind])
-                    if self._lines[ind] == '':
-                        del self._lines[ind]
-                    elif fold['change'] == -1:
-                        ind += 1
-                        closing_folds += 1
-                    else:
-                        state = 'before'
-                        break
+            closing_fold_lines = [line]
+            next_line = None
+            for next_line in lines:
+                if next_line == '':
+                    next_line = None
+                elif tokenize_line(next_line).fold_change == -1:
+                    closing_fold_lines.append(next_line)
+                    next_line = None
+                else:
+                    break
 
-                wanted_empty_line_count = int(self._config['wanted_empty_lines_between_items'])
-                deleted_empty_lines = 0
-                LOG.debug("Detected {} closing folds".format(closing_folds))
-                for empty_ind in reversed(empty_lines_before):
-                    if closing_folds + len(empty_lines_before) - deleted_empty_lines <= wanted_empty_line_count:
-                        LOG.debug("breaking out of delete empty line loop at line: {}".format(
-                            self._lines[empty_ind-1],
-                        ))
-                        break
+            LOG.debug("Detected %s closing folds", len(closing_fold_lines))
+            remove_empty_line = held_lines and len(closing_fold_lines) + 1 > wanted_empty_line_count
+            if remove_empty_line:
+                del held_lines[0]
 
-                    del self._lines[empty_ind]
-                    deleted_empty_lines += 1
+            yield from held_lines
+            held_lines = []
+            yield from closing_fold_lines
 
-                empty_lines_before = []
-                closing_folds = 0
+            # The line following the closing folds is passed through as is.
+            # When an empty line was removed, the line after it is passed
+            # through as well.
+            if next_line is not None:
+                yield next_line
+                if remove_empty_line:
+                    yield from islice(lines, 1)
+
+        yield from held_lines
 
     def _get_section_level(self, heading_char):
         if heading_char in self._section_levels:
@@ -568,10 +979,9 @@ class YamlRstReformatter(object):
                 self._set_section_levels(section['subsections'])
 
             if 'section_level' not in section and section['lines']:
-                _re_heading_chars = self._RE_HEADING_CHARS.search(section['lines'][0])
-                if _re_heading_chars:
-                    section['section_level'] = self._get_section_level(
-                        _re_heading_chars.group('heading_char'))
+                heading_char = tokenize_line(section['lines'][0]).heading_char
+                if heading_char is not None:
+                    section['section_level'] = self._get_section_level(heading_char)
 
     def _sort_section_levels(self, sections, section_level=0):
 
@@ -592,10 +1002,11 @@ class YamlRstReformatter(object):
 
                 if section.get('section_level', section_level) is not None \
                         and section.get('section_level', section_level) > section_level:
-                    LOG.debug("Moving section {} into subsection of previous section {}".format(
+                    LOG.debug(
+                        "Moving section %s into subsection of previous section %s",
                         section,
                         sections[sec_ind-1],
-                    ))
+                    )
                     sections[sec_ind-1].setdefault('subsections', [])
                     sections[sec_ind-1]['subsections'].append(section)
                     del sections[sec_ind]
@@ -628,7 +1039,7 @@ class YamlRstReformatter(object):
                         break
 
                     if section_level == subsection.get('section_level', -2):
-                        sections.insert(sec_ind + 1, deepcopy(subsection))
+                        sections.insert(sec_ind + 1, subsection)
                         del section['subsections'][subsec_ind]
 
                 self._sort_section_levels_equal(section['subsections'])
@@ -650,7 +1061,7 @@ class YamlRstReformatter(object):
             if not section.get('lines', []):
                 continue
 
-            LOG.debug('sec_ind: {}, section: {}'.format(sec_ind, section['lines']))
+            LOG.debug('sec_ind: %s, section: %s', sec_ind, section['lines'])
 
             heading_char = None
             heading_char_inds = []
@@ -666,7 +1077,7 @@ class YamlRstReformatter(object):
 
             if sec_ind == 0 and self._get_header_end_ind(section['lines']) is not None:
                 header_end = self._get_header_end_ind(section['lines'])
-                LOG.debug('header_end_ind: {}'.format(header_end))
+                LOG.debug('header_end_ind: %s', header_end)
                 # Don’t rewrite the header. self._update_header also wants something to do ;)
                 ind = header_end
 
@@ -685,13 +1096,12 @@ class YamlRstReformatter(object):
                     heading_ind = None
 
                 if LOG.isEnabledFor(logging.DEBUG):
-                    LOG.debug("processing line: '{}'".format(line))
-                    LOG.debug("sections: \n{}".format(pprint.pformat(sections)))
+                    LOG.debug("processing line: '%s'", line)
+                    LOG.debug("sections: \n%s", _pformat(sections))
                     LOG.debug(
-                        'ind: {}, state: {}, heading_char: {}, heading_char_inds: {},'
-                        ' heading: {}, heading_ind: {}'.format(
-                            ind, state, heading_char, heading_char_inds, heading, heading_ind,
-                        )
+                        'ind: %s, state: %s, heading_char: %s, heading_char_inds: %s,'
+                        ' heading: %s, heading_ind: %s',
+                        ind, state, heading_char, heading_char_inds, heading, heading_ind,
                     )
 
                 if line == '#' and state == 'before':
@@ -699,27 +1109,26 @@ class YamlRstReformatter(object):
                     ind -= 1
                     continue
 
-                _re_heading_chars = self._RE_HEADING_CHARS.search(line)
-                _re_heading = re.search(r'#\s+(?P<heading>[^\s].+)$', line)
-                if _re_heading_chars:
+                token = tokenize_line(line)
+                if token.heading_char is not None:
                     LOG.debug('_re_heading_chars')
-                    if heading_char is not None and heading_char != _re_heading_chars.group('heading_char'):
+                    if heading_char is not None and heading_char != token.heading_char:
                         LOG.warning(
                             "Not modifying section heading with mismatching heading characters."
                             " Top header character: '{top_heading_char}'."
                             " Bottom header character: '{bottom_heading_char}'.".format(
                                 top_heading_char=heading_char,
-                                bottom_heading_char=_re_heading_chars.group('heading_char'),
+                                bottom_heading_char=token.heading_char,
                             )
                         )
                         state = 'before'
                         continue
-                    heading_char = _re_heading_chars.group('heading_char')
+                    heading_char = token.heading_char
                     heading_char_inds.append(ind)
                     state = 'heading'
-                elif _re_heading and (state == 'heading' or not heading_char_inds):
-                    heading = _re_heading.group('heading')
-                    LOG.debug('_re_heading: {}'.format(heading))
+                elif token.heading is not None and (state == 'heading' or not heading_char_inds):
+                    heading = token.heading
+                    LOG.debug('_re_heading: %s', heading)
                     heading_ind = ind
                     state = 'heading'
                 else:
@@ -728,10 +1137,10 @@ class YamlRstReformatter(object):
                 eof = ind+1 not in range(len(section['lines']))
                 if heading_char_inds and heading is not None and (eof or state == 'before'):
                     section_start = min([heading_ind] + heading_char_inds[1:])
-                    LOG.debug('Deleting lines at: {}'.format([heading_ind] + heading_char_inds[1:]))
+                    LOG.debug('Deleting lines at: %s', [heading_ind] + heading_char_inds[1:])
                     ind_offset = 0
                     for del_ind in [heading_ind] + heading_char_inds[1:]:
-                        LOG.debug("Deleting line: {}".format(section['lines'][del_ind + ind_offset]))
+                        LOG.debug("Deleting line: %s", section['lines'][del_ind + ind_offset])
                         del section['lines'][del_ind + ind_offset]
                         ind_offset -= 1
                     ind += ind_offset
@@ -742,10 +1151,10 @@ class YamlRstReformatter(object):
                         section['fold_name'] = heading
                     else:
                         LOG.debug('Creating new fold')
-                        new_section = {
-                            'lines': strip_list(section['lines'][section_start - 1:]),
-                            'fold_name': heading,
-                        }
+                        new_section = Section(
+                            lines=strip_list(section['lines'][section_start - 1:]),
+                            fold_name=heading,
+                        )
                         section_level = self._get_section_level(heading_char)
                         if section_level != 0:
                             new_section['section_level'] = section_level
@@ -753,10 +1162,10 @@ class YamlRstReformatter(object):
                             new_section['subsections'] = section['subsections']
                             del section['subsections']
                         if LOG.isEnabledFor(logging.DEBUG):
-                            LOG.debug('section start: {}'.format(section_start))
-                            LOG.debug('section level: {}'.format(section_level))
-                            LOG.debug('sec_ind: {}'.format(sec_ind))
-                            LOG.debug("new section: \n{}".format(pprint.pformat(new_section)))
+                            LOG.debug('section start: %s', section_start)
+                            LOG.debug('section level: %s', section_level)
+                            LOG.debug('sec_ind: %s', sec_ind)
+                            LOG.debug("new section: \n%s", _pformat(new_section))
                         section['lines'] = section['lines'][:section_start - 1]
                         sections.insert(sec_ind + 1, new_section)
 
@@ -766,7 +1175,7 @@ class YamlRstReformatter(object):
                         section['fold_name'] = heading
 
                     state = 'before'
-                    LOG.debug('state: {}, ind: {}'.format(state, ind))
+                    LOG.debug('state: %s, ind: %s', state, ind)
 
     def _get_header_end_ind(self, lines):
         return get_last_index(lines, self._HEADER_END_LINES[self._preset])
@@ -794,18 +1203,18 @@ class YamlRstReformatter(object):
 
         if header_end is not None:
             for _ in range(header_start, header_end + 1):
-                fold = self._get_line_fold(self._lines[header_start])
-                header_fold_unbalance -= fold['change']
+                header_fold_unbalance -= tokenize_line(self._lines[header_start]).fold_change
                 del self._lines[header_start]
 
         header = self._get_rendered_template('defaults_header').split('\n')
         for line in header:
-            fold = self._get_line_fold(line)
-            header_fold_unbalance += fold['change']
-            LOG.debug('fold change: {}, line: {}'.format(fold['change'], line))
-        LOG.debug('header_fold_unbalance in from _get_rendered_template: {}'.format(
+            fold_change = tokenize_line(line).fold_change
+            header_fold_unbalance += fold_change
+            LOG.debug('fold change: %s, line: %s', fold_change, line)
+        LOG.debug(
+            'header_fold_unbalance in from _get_rendered_template: %s',
             header_fold_unbalance,
-        ))
+        )
 
         header_end = insert_list(
             self._lines,
@@ -836,7 +1245,7 @@ class YamlRstReformatter(object):
             for _ in range(wanted_empty_line_count, empty_line_count):
                 del self._lines[header_end + 1]
 
-        LOG.debug('self._last_line_fold_yaml_block: {}'.format(self._last_line_fold_yaml_block))
+        LOG.debug('self._last_line_fold_yaml_block: %s', self._last_line_fold_yaml_block)
         self._lines.extend(self._get_closing_folds(
             header_fold_unbalance,
             self._last_line_fold_yaml_block,
@@ -844,131 +1253,280 @@ class YamlRstReformatter(object):
 
     @staticmethod
     def _check_ends_with_yaml_block(lines):
-        start_leading_spaces = None
-        leading_spaces = 0
-        yaml_block = False
-        for line in lines:
-            if line in ['', '# ]]]']:
-                continue
+        return _YamlBlockState().feed(lines)
+
+    def _is_formatted(self):
+        """Return True if the instance lines are already formatted.
+
+        This is checked in one pass over the lines against the output of the
+        reformatting stages: The rendered header followed by top level
+        sections which all use the same heading character and variable folds.
+        Everything else, for example nested sections, folds inside of variable
+        folds or RST sections which are not folds, counts as not formatted so
+        that the full reformatting is done. The names of the variables are
+        collected for :meth:`_check_var_names`.
+        """
 
-            leading_spaces = len(line) - len(line.lstrip(' '))
+        lines = self._lines
+        tokens = tokenize_lines(lines)
+        line_count = len(lines)
+        wanted_empty_line_count = int(self._config['wanted_empty_lines_between_items'])
+        closing_fold = self._config['closing_fold_format_spec'].format('# ]]]')
+        require_comment = self._config.get('add_string_for_missing_comment', '') != ''
+        header_end_lines = self._HEADER_END_LINES[self._preset]
 
-            if yaml_block and leading_spaces < start_leading_spaces+2:
-                yaml_block = False
+        try:
+            header = self._get_rendered_template('defaults_header').split('\n')
+        except YamlRstReformatterError:
+            # Reported by _update_header.
+            return False
+        header_end = len(header) + wanted_empty_line_count
+        if (lines[:len(header)] != header or
+                lines[len(header):header_end] != [''] * wanted_empty_line_count or
+                header_end >= line_count or
+                self._get_header_end_ind(header) != len(header) - 1 or
+                any(token.fold_change or token.var_name is not None for token in tokens[:len(header)])):
+            return False
+
+        def is_comment(ind):
+            # Except for the header, the lines should not be changed by
+            # _reformat_legacy_rst_sections or _update_header. The former
+            # removes '#' lines which do not follow a possible heading.
+            return (tokens[ind].kind == KIND_COMMENT and not tokens[ind].envvar and
+                    lines[ind] not in header_end_lines and
+                    (lines[ind] != '#' or tokens[ind - 1].heading is not None))
+
+        def is_closing_fold(ind, start_ind):
+            if ind >= line_count or tokens[ind].fold_change != -1:
+                return False
+            if self._check_ends_with_yaml_block(lines[start_ind:ind]):
+                return lines[ind] == '# ]]]'
+            return lines[ind] == closing_fold
+
+        def has_wanted_empty_lines(ind, empty_line_count):
+            # See _iter_lines_without_needless_newlines.
+            closing_folds_end = ind
+            while closing_folds_end < line_count and tokens[closing_folds_end].fold_change == -1:
+                closing_folds_end += 1
+            remove_empty_line = (lines[ind].startswith(' ') and
+                                 closing_folds_end - ind + 1 > wanted_empty_line_count)
+            return empty_line_count == (0 if remove_empty_line else 1)
+
+        def get_variable_end(ind):
+            start_ind = ind
+            var_name = tokens[ind].fold_name[len('.. envvar:: '):]
+            if lines[ind] != '# .. envvar:: {} [[['.format(var_name):
+                return None
 
-            if line.endswith(': |'):
-                yaml_block = True
-                start_leading_spaces = leading_spaces
-            elif re.search(r'^\w+:', line):
-                yaml_block = False
-                start_leading_spaces = None
+            ind += 1
+            if ind >= line_count or lines[ind] != '#':
+                return None
 
-        return yaml_block
+            ind += 1
+            comment_start = ind
+            while ind < line_count and is_comment(ind):
+                ind += 1
+            if require_comment and ind == comment_start:
+                return None
+            if ind >= line_count or tokens[ind].var_name != var_name:
+                return None
+            var_names.add(var_name)
 
-    def _reformat_variables(self, sections, parent_section_level=None):
-        if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('Called _reformat_variables with sections:\n{}'.format(
-                pprint.pformat(sections),
-            ))
-        sec_ind = -1
-        while True:
-            sec_ind += 1
-            try:
-                section = sections[sec_ind]
-            except IndexError:
-                LOG.debug("break")
-                break
+            ind += 1
+            empty_line_count = 0
+            while ind < line_count and (lines[ind] == '' or
+                                        lines[ind].startswith(' ') and tokens[ind].fold_change == 0):
+                empty_line_count = empty_line_count + 1 if lines[ind] == '' else 0
+                ind += 1
+            if not is_closing_fold(ind, start_ind) or not has_wanted_empty_lines(ind, empty_line_count):
+                return None
 
-            LOG.debug('Processing sec_ind: {}, section: {}'.format(sec_ind, section))
+            return ind + 1
 
-            lines = section.get('lines', [])
-            ind = -1
-            while True:
+        def get_section_end(ind):
+            start_ind = ind
+            fold_name = tokens[ind].fold_name
+            if fold_name == '' or fold_name.startswith('.') or lines[ind] != '# {} [[['.format(fold_name):
+                return None
+
+            ind += 1
+            heading_char = tokens[ind].heading_char if ind < line_count else None
+            if heading_char is None or lines[ind] != '# ' + heading_char * (len(lines[start_ind]) - 2):
+                return None
+            if heading_chars and heading_char not in heading_chars:
+                return None
+            heading_chars.add(heading_char)
+
+            ind += 1
+            empty_line_count = 0
+            has_text = False
+            while ind < line_count and (lines[ind] == '' or is_comment(ind)):
+                if lines[ind] == '':
+                    empty_line_count += 1
+                else:
+                    if not has_text and empty_line_count != 1:
+                        return None
+                    has_text = True
+                    empty_line_count = 0
                 ind += 1
-                try:
-                    line = lines[ind]
-                except IndexError:
-                    break
 
-                if re.search(r'^# \.\. envvar::', line):
-                    del lines[ind]
-                    ind -= 1
-                    continue
+            if ind < line_count and tokens[ind].fold_change == +1:
+                if empty_line_count != 1:
+                    return None
+                while ind is not None and ind < line_count and tokens[ind].fold_change == +1:
+                    if not tokens[ind].fold_name.startswith('.. envvar:: '):
+                        return None
+                    ind = get_variable_end(ind)
+                if ind is None or not is_closing_fold(ind, start_ind):
+                    return None
+            elif not is_closing_fold(ind, start_ind) or not has_wanted_empty_lines(ind, empty_line_count):
+                return None
+
+            return ind + 1
+
+        var_names = set()
+        heading_chars = set()
+        ind = header_end
+        while ind < line_count:
+            if tokens[ind].fold_change != +1:
+                end_ind = None
+            elif tokens[ind].fold_name.startswith('.. envvar:: '):
+                end_ind = get_variable_end(ind)
+            else:
+                end_ind = get_section_end(ind)
+            if end_ind is None:
+                LOG.debug("Input is not formatted in the fold starting at line %s.", ind + 1)
+                return False
+            ind = end_ind
+
+        self._var_names.update(var_names)
+        return True
+
+    def _get_variable_boundaries(self, lines, tokens):
+        """Return the comment start and next entry index for each line.
+
+        The comment start of a line is the index of the first line of the
+        comment block directly above it, or the index of the line itself if it
+        is not preceded by a comment. The next entry of a line is the index of
+        the next line which is neither empty nor indented, or None.
+        Both are computed in one sweep so that the sections can be split
+        without searching through the lines for each variable.
+        """
 
-                variable_name_re = re.search(
-                    r'^(?P<var_name>\w+):\s*(?P<yaml_block>\|?)',
-                    line,
-                )
-                if not variable_name_re:
-                    continue
+        comment_starts = []
+        for ind, line in enumerate(lines):
+            if ind > 0 and lines[ind - 1].startswith('#'):
+                comment_starts.append(comment_starts[ind - 1])
+            else:
+                comment_starts.append(ind)
 
-                if LOG.isEnabledFor(logging.DEBUG):
-                    LOG.debug('sections:\n{}'.format(
-                        pprint.pformat(sections),
-                    ))
-                LOG.debug('Processing section: {}'.format(section))
-                LOG.debug('Processing line: {}'.format(line))
-
-                new_section = {}
-                var_name = variable_name_re.group('var_name')
-                self._var_names.add(var_name)
-                LOG.debug('Found variable {} at line: {}'.format(var_name, ind))
-
-                begin_section_line_ind = ind
-                for rsearch_ind, rsearch_line in reversed(list(enumerate(lines[:ind]))):
-                    if rsearch_line.startswith('#'):
-                        begin_section_line_ind = rsearch_ind
-                    else:
-                        break
-                LOG.debug("begin_section_line_ind: {}".format(begin_section_line_ind))
+        next_entries = [None] * len(lines)
+        next_entry_ind = None
+        for ind in range(len(lines) - 1, -1, -1):
+            next_entries[ind] = next_entry_ind
+            if tokens[ind].kind != KIND_BLANK and not lines[ind].startswith(' '):
+                next_entry_ind = ind
+
+        return comment_starts, next_entries
+
+    def _split_section_by_variables(self, section, parent_section_level=None):
+        """Split the section into one section per variable definition.
+
+        Returns the list of sections which replace the given section. The
+        first one is the given section itself. The part starting with a
+        variable which can not be split off on the same level is moved into a
+        new first subsection.
+        """
+
+        lines = section.get('lines')
+        if not lines:
+            return [section]
+
+        tokens = tokenize_lines(lines)
+        if not any(token.var_name is not None or token.envvar for token in tokens):
+            return [section]
+
+        comment_starts, next_entries = self._get_variable_boundaries(lines, tokens)
+
+        def get_lines(begin, end=None):
+            # Unfolded envvar directives are regenerated as fold names.
+            return [lines[ind] for ind in range(begin, len(lines) if end is None else end)
+                    if not tokens[ind].envvar]
+
+        split_sections = [section]
+        current_section = section
+        current_begin = 0
+        current_end = None
+        ind = 0
+        while ind < len(lines):
+            var_name = tokens[ind].var_name
+            if var_name is None:
+                ind += 1
+                continue
+
+            self._var_names.add(var_name)
+            begin_section_line_ind = max(comment_starts[ind], current_begin)
+            next_entry_start_ind = next_entries[ind]
+            LOG.debug(
+                'Found variable %s at line: %s, begin_section_line_ind: %s, next_entry_start_ind: %s',
+                var_name, ind, begin_section_line_ind, next_entry_start_ind,
+            )
 
-                new_section['fold_name'] = '.. envvar:: {var_name}'.format(
+            if begin_section_line_ind == current_begin:
+                current_section.fold_name = '.. envvar:: {var_name}'.format(
                     var_name=var_name,
                 )
                 if parent_section_level is not None:
-                    new_section['section_level'] = None
+                    current_section.section_level = None
 
-                next_entry_start_ind = get_first_match(
-                    r'^[^ ]',
-                    lines[ind + 1:],
-                    ind_offset=ind + 1,
-                )
-                LOG.debug('next_entry_start_ind: {}, line: {}'.format(
-                    next_entry_start_ind,
-                    lines[next_entry_start_ind] if next_entry_start_ind is not None else '%',
-                ))
+                if next_entry_start_ind is None:
+                    break
 
-                if begin_section_line_ind == 0:
-                    LOG.debug('Updating current section with: {}'.format(new_section))
-                    section.update(new_section)
+                LOG.debug("Splitting section into two sections. Moving next part into its own section")
+                current_section.lines = get_lines(current_begin, next_entry_start_ind)
+                current_section = current_section.split(len(current_section.lines))
+                split_sections.append(current_section)
+                current_begin = ind = next_entry_start_ind
+
+            elif 'fold_name' in current_section:
+                LOG.debug("Splitting section into two sections. Moving variable start into new subsection.")
+                current_end = begin_section_line_ind
+                # The subsection is processed again by the caller which also
+                # removes the remaining envvar directives.
+                current_section.insert_subsection(0, Section(lines=lines[begin_section_line_ind:]))
+                if 'section_level' in current_section:
+                    current_section.subsections[0].section_level = current_section.section_level
+                break
 
-                    if next_entry_start_ind is not None:
-                        LOG.debug("Splitting section into two sections. Moving next part into its own section")
-                        new_section['lines'] = lines[next_entry_start_ind:]
-                        sections[sec_ind + 1:sec_ind + 1] = [deepcopy(section)]
+            else:
+                LOG.debug("Splitting section into two sections. Moving variable start into new section.")
+                current_section.lines = get_lines(current_begin, begin_section_line_ind)
+                current_section = current_section.split(len(current_section.lines))
+                split_sections.append(current_section)
+                current_begin = begin_section_line_ind
 
-                        sections[sec_ind + 1].pop('fold_name', None)
-                        sections[sec_ind + 1]['lines'][0:next_entry_start_ind] = []
+        current_section.lines = get_lines(current_begin, current_end)
 
-                        section['lines'][next_entry_start_ind:] = []
-                        section.pop('subsections', None)
+        return split_sections
 
-                else:
-                    sections[sec_ind + 1:sec_ind + 1] = [deepcopy(section)]
-
-                    sections[sec_ind + 1].pop('fold_name', None)
-                    sections[sec_ind + 1]['lines'][0:begin_section_line_ind] = []
-                    section['lines'][begin_section_line_ind:] = []
-
-                    if 'fold_name' in section:
-                        LOG.debug("Splitting section into two sections. Moving variable start into new subsection.")
-                        sections[sec_ind + 1].pop('subsections', None)
-                        section.setdefault('subsections', [])
-                        section['subsections'][0:0] = [sections[sec_ind + 1]]
-                        del sections[sec_ind + 1]
-                    else:
-                        LOG.debug("Splitting section into two sections. Moving variable start into new section.")
-                        section.pop('subsections', None)
+    def _reformat_variables(self, sections, parent_section_level=None):
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug(
+                'Called _reformat_variables with sections:\n%s',
+                _pformat(sections),
+            )
 
+        split_sections = []
+        for section in sections:
+            # Sections might have been passed as dicts.
+            section = Section.from_mapping(section)
+            LOG.debug('Processing section: %s', section)
+            split_sections.extend(self._split_section_by_variables(
+                section,
+                parent_section_level=parent_section_level,
+            ))
+        sections[:] = split_sections
+
+        for section in sections:
             if 'subsections' in section:
                 self._reformat_variables(section['subsections'], parent_section_level=section.get('section_level'))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Section tree nodes of yaml4rst
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['Section']
+
+
+class Section(object):
+    """Node of the section tree.
+
+    A section consists of its lines, an optional fold name, optional
+    subsections and an optional section level. For compatibility with code
+    and tests which use plain dicts, a section can be used like a dict with
+    the keys ``lines``, ``fold_name``, ``subsections`` and ``section_level``.
+    An unset attribute is a missing key.
+
+    Sections are split and moved by handing over the line lists and
+    subsections instead of copying them.
+    """
+
+    __slots__ = ('lines', 'fold_name', 'subsections', 'section_level')
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Return the given dict as :class:`Section` including all subsections."""
+        if isinstance(mapping, cls):
+            return mapping
+
+        section = cls(**mapping)
+        if 'subsections' in mapping:
+            section.subsections = [cls.from_mapping(subsection) for subsection in mapping['subsections']]
+        return section
+
+    def split(self, ind, move_subsections=True):
+        """Split the section at the given line index and return the new second part.
+
+        The lines starting at ``ind`` are moved into the new section, the line
+        list of this section is truncated in place. The fold name stays with this
+        section, the section level is kept by both. With ``move_subsections``,
+        the subsections are moved to the new section.
+        """
+        new_section = Section(lines=self.lines[ind:])
+        del self.lines[ind:]
+
+        if 'section_level' in self:
+            new_section.section_level = self.section_level
+        if move_subsections and 'subsections' in self:
+            new_section.subsections = self.subsections
+            del self.subsections
+
+        return new_section
+
+    def insert_subsection(self, ind, subsection):
+        """Insert the given section into the subsections of this section."""
+        if 'subsections' not in self:
+            self.subsections = []
+        self.subsections.insert(ind, subsection)
+
+    def keys(self):
+        return [key for key in self.__slots__ if key in self]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def __eq__(self, other):
+        if isinstance(other, (Section, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
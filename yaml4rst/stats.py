@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-stage profiling statistics of yaml4rst
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+__all__ = ['StageStats', 'ReformatStats']
+
+
+class StageStats(object):
+    """Accumulated statistics of one reformatting stage."""
+
+    __slots__ = ('runs', 'time', 'max_time', 'lines', 'sections')
+
+    def __init__(self):
+        # Number of times the stage was run.
+        self.runs = 0
+        # Sum and maximum of the wall time in seconds.
+        self.time = 0.0
+        self.max_time = 0.0
+        # Sum of the line and section counts after the stage.
+        self.lines = 0
+        self.sections = 0
+
+    def add(self, duration, line_count, section_count):
+        self.runs += 1
+        self.time += duration
+        self.max_time = max(self.max_time, duration)
+        self.lines += line_count
+        self.sections += section_count
+
+    def merge(self, other):
+        self.runs += other.runs
+        self.time += other.time
+        self.max_time = max(self.max_time, other.max_time)
+        self.lines += other.lines
+        self.sections += other.sections
+
+
+class ReformatStats(object):
+    """Wall time, line count and section count per reformatting stage.
+
+    An instance is filled by :class:`~yaml4rst.reformatter.YamlRstReformatter`
+    for one file. Statistics of multiple files, possibly processed in other
+    processes, are combined with :meth:`merge`.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.stages = OrderedDict()
+
+    def add(self, stage, duration, line_count, section_count):
+        """Record one run of the given stage."""
+        self.stages.setdefault(stage, StageStats()).add(duration, line_count, section_count)
+
+    def merge(self, other):
+        """Add the statistics of the other instance to this one."""
+        self.files += other.files
+        for stage, stage_stats in other.stages.items():
+            self.stages.setdefault(stage, StageStats()).merge(stage_stats)
+
+    def get_total_time(self):
+        return sum(stage_stats.time for stage_stats in self.stages.values())
+
+    def get_table(self):
+        """Return the statistics as human readable table."""
+
+        total_time = self.get_total_time()
+        rows = [('stage', 'runs', 'total [s]', 'mean [ms]', 'max [ms]', 'share', 'lines', 'sections')]
+        for stage, stage_stats in self.stages.items():
+            rows.append((
+                stage,
+                str(stage_stats.runs),
+                '{:.4f}'.format(stage_stats.time),
+                '{:.3f}'.format(stage_stats.time / stage_stats.runs * 1000),
+                '{:.3f}'.format(stage_stats.max_time * 1000),
+                '{:.1%}'.format(stage_stats.time / total_time if total_time else 0),
+                str(stage_stats.lines),
+                str(stage_stats.sections),
+            ))
+        rows.append(('total ({} files)'.format(self.files), '', '{:.4f}'.format(total_time), '', '', '', '', ''))
+
+        widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+        return '\n'.join(
+            '  '.join(
+                cell.ljust(widths[col]) if col == 0 else cell.rjust(widths[col])
+                for col, cell in enumerate(row)
+            ).rstrip()
+            for row in rows
+        )
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+Splitting of concatenated input documents of yaml4rst
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['iter_documents']
+
+
+def iter_documents(input_fh, delimiter=b'\0', chunk_size=65536):
+    """Yield the documents separated by the delimiter from the given binary file object.
+
+    Each document is yielded as bytes as soon as its delimiter has been read
+    so that it can be processed while the following documents are still being
+    written to a pipe. Data after the last delimiter is yielded as last
+    document unless it is empty.
+    """
+
+    if not delimiter:
+        raise ValueError("The delimiter must not be empty.")
+
+    # read1 returns what is available instead of waiting for a full chunk.
+    read = getattr(input_fh, 'read1', input_fh.read)
+    buffered = bytearray()
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+
+        # The delimiter could start in the previous chunk.
+        search_start = max(0, len(buffered) - len(delimiter) + 1)
+        buffered += chunk
+        start = 0
+        end = buffered.find(delimiter, search_start)
+        while end != -1:
+            yield bytes(buffered[start:end])
+            start = end + len(delimiter)
+            end = buffered.find(delimiter, start)
+        del buffered[:start]
+
+    if buffered:
+        yield bytes(buffered)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Line tokenizer of yaml4rst
+
+Each line is classified once into a :class:`LineToken` which all reformatting
+stages consume instead of matching the line against regular expressions again.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+__all__ = [
+    'LineToken', 'tokenize_line', 'tokenize_lines', 'RE_NEWLINE', 'RE_HEADING_CHARS',
+    'KIND_BLANK', 'KIND_FOLD_OPEN', 'KIND_FOLD_CLOSE', 'KIND_HEADING_CHARS',
+    'KIND_VARIABLE', 'KIND_COMMENT', 'KIND_OTHER',
+]
+
+KIND_BLANK = 'blank'
+KIND_FOLD_OPEN = 'fold_open'
+KIND_FOLD_CLOSE = 'fold_close'
+KIND_HEADING_CHARS = 'heading_chars'
+KIND_VARIABLE = 'variable'
+KIND_COMMENT = 'comment'
+KIND_OTHER = 'other'
+
+LineToken = namedtuple('LineToken', [
+    # Primary classification of the line, one of the ``KIND_*`` constants.
+    'kind',
+    # +1 for an opening fold marker, -1 for a closing fold marker, 0 otherwise.
+    'fold_change',
+    # Name of an opening fold, None otherwise.
+    'fold_name',
+    # Character of a RST heading over/underline like "# ====", None otherwise.
+    'heading_char',
+    # Text of a comment which could be a RST heading, None otherwise.
+    'heading',
+    # Name of a top level YAML variable defined on the line, None otherwise.
+    'var_name',
+    # True if the line is an unfolded "# .. envvar::" RST directive.
+    'envvar',
+])
+
+# All regular expressions of yaml4rst are compiled once here.
+# The line patterns are only searched when cheap string checks show that they
+# can match at all. Searching the fold patterns in comment lines with a lot of
+# whitespace takes long because of backtracking.
+# Refer to benchmarks/tokenizer.py for the timings.
+
+RE_NEWLINE = re.compile(r'\r\n|\r|\n')
+
+# Lines need to end with one of these characters or a digit to match.
+# Lines ending with a digit are checked by _RE_FOLD_OPEN_END first.
+_RE_FOLD_OPEN = re.compile(r'^\s*#\s*(?P<fold_name>(?:\.{2})?\s*.*?)\s*[\[({]{3}(?P<fold_level>\d*)$')
+_RE_FOLD_OPEN_END = re.compile(r'[\[({]{3}\d+$')
+_FOLD_OPEN_CHARS = '[({'
+# Same as r'^\s*#\s*(?:\.{2})?\s*[\])}]{3}$' without the adjacent whitespace
+# quantifiers which backtrack quadratically.
+_RE_FOLD_CLOSE = re.compile(r'^\s*#\s*(?:\.{2}\s*)?[\])}]{3}$')
+_FOLD_CLOSE_CHARS = '])}'
+
+# Lines need to start with "#" to match.
+RE_HEADING_CHARS = re.compile(r'^#\s(?P<heading_char>[^a-zA-Z0-9]){3,999}$')
+_ENVVAR_PREFIX = '# .. envvar::'
+
+# Lines need to contain "#" to match.
+_RE_HEADING = re.compile(r'#\s+(?P<heading>[^\s].+)$')
+
+# Lines need to contain ":" to match.
+_RE_VAR_NAME = re.compile(r'^(?P<var_name>\w+):')
+
+
+@lru_cache(maxsize=2**16)
+def tokenize_line(line):
+    """Return the :class:`LineToken` for the given line.
+
+    The result is cached because the same lines are looked at again and again
+    by the reformatting stages and also repeat a lot between files.
+    """
+
+    fold_change = 0
+    fold_name = None
+    heading_chars_re = None
+    heading_re = None
+    var_name_re = None
+
+    if '#' in line:
+        # ``$`` also matches before a trailing newline.
+        last_char = line[-2] if line.endswith('\n') and len(line) > 1 else line[-1]
+        fold_open_re = None
+        if last_char in _FOLD_OPEN_CHARS or (last_char.isdecimal() and _RE_FOLD_OPEN_END.search(line)):
+            fold_open_re = _RE_FOLD_OPEN.search(line)
+        if fold_open_re:
+            if fold_open_re.group('fold_level') != '':
+                raise NotImplementedError(
+                    "Found explicit fold level. See under known limitations in the docs.")
+            fold_change = +1
+            fold_name = fold_open_re.group('fold_name')
+        elif last_char in _FOLD_CLOSE_CHARS and _RE_FOLD_CLOSE.search(line):
+            fold_change = -1
+
+        if line[0] == '#':
+            heading_chars_re = RE_HEADING_CHARS.search(line)
+        heading_re = _RE_HEADING.search(line)
+
+    if ':' in line:
+        var_name_re = _RE_VAR_NAME.search(line)
+
+    if line == '':
+        kind = KIND_BLANK
+    elif fold_change == +1:
+        kind = KIND_FOLD_OPEN
+    elif fold_change == -1:
+        kind = KIND_FOLD_CLOSE
+    elif heading_chars_re:
+        kind = KIND_HEADING_CHARS
+    elif var_name_re:
+        kind = KIND_VARIABLE
+    elif line.startswith('#'):
+        kind = KIND_COMMENT
+    else:
+        kind = KIND_OTHER
+
+    return LineToken(
+        kind=kind,
+        fold_change=fold_change,
+        fold_name=fold_name,
+        heading_char=heading_chars_re.group('heading_char') if heading_chars_re else None,
+        heading=heading_re.group('heading') if heading_re else None,
+        var_name=var_name_re.group('var_name') if var_name_re else None,
+        envvar=line.startswith(_ENVVAR_PREFIX),
+    )
+
+
+def tokenize_lines(lines):
+    """Return the list of :class:`LineToken` for the given lines."""
+    return [tokenize_line(line) for line in lines]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Atomic output file writer of yaml4rst
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import stat
+
+__all__ = ['FSYNC_POLICIES', 'OutputWriter']
+
+LOG = logging.getLogger(__name__)
+
+#: When output files are synchronized to the storage device.
+#: ``never`` leaves it to the operating system, ``file`` synchronizes each
+#: file before it replaces the previous file and ``batch`` synchronizes all
+#: written files at once when :meth:`OutputWriter.sync` is called.
+FSYNC_POLICIES = ['never', 'file', 'batch']
+
+
+def _fsync_path(path):
+    # Directories can only be opened read-only.
+    file_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(file_fd)
+    finally:
+        os.close(file_fd)
+
+
+def _fsync_dir(dir_path):
+    try:
+        _fsync_path(dir_path)
+    except (IOError, OSError) as err:
+        # Not supported on all platforms and file systems.
+        LOG.debug("Could not synchronize directory %s: %s", dir_path, err)
+
+
+def _get_umask():
+    # The umask can only be read by setting it.
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+class OutputWriter(object):
+    """Writer which replaces output files atomically.
+
+    The content is written to a temporary file in the directory of the output
+    file which is then renamed to the output file so that the output file is
+    never left partially written. Output files which are no regular files,
+    like :file:`/dev/null` or FIFOs, are written directly. The file mode and ownership of an existing
+    output file are kept. If that is not possible, for example because the
+    directory is not writable or the owner can not be kept, the output file
+    is overwritten directly instead.
+    Refer to :data:`FSYNC_POLICIES` for the ``fsync`` policies.
+    """
+
+    def __init__(self, fsync='never'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy {}, known policies: {}.".format(
+                fsync, ', '.join(FSYNC_POLICIES),
+            ))
+        self.fsync = fsync
+        #: Files written since the last :meth:`sync` in ``batch`` mode.
+        self.pending_paths = []
+
+    def write(self, output_file, content):
+        """Write the content to the given output file path."""
+
+        # Replace the target of symbolic links, not the link.
+        output_file = os.path.realpath(output_file)
+        try:
+            file_stat = os.stat(output_file)
+        except FileNotFoundError:
+            file_stat = None
+
+        # Devices, FIFOs and sockets can not be replaced and are written directly.
+        # They are not synchronized as they are no files on a storage device.
+        if file_stat is not None and not stat.S_ISREG(file_stat.st_mode):
+            with open(output_file, 'w', encoding='utf-8') as output_fh:
+                output_fh.write(content)
+            return
+
+        if not self._replace(output_file, content, file_stat):
+            with open(output_file, 'w', encoding='utf-8') as output_fh:
+                output_fh.write(content)
+                if self.fsync == 'file':
+                    output_fh.flush()
+                    os.fsync(output_fh.fileno())
+
+        if self.fsync == 'batch':
+            self.pending_paths.append(output_file)
+
+    def _replace(self, output_file, content, file_stat):
+        """Replace the output file atomically and return True or return False if that is not possible."""
+
+        # Imported here as the CLI imports this module before parsing the arguments.
+        import tempfile
+
+        output_dir = os.path.dirname(output_file)
+        try:
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix='.', suffix='.yaml4rst.tmp')
+        except (IOError, OSError) as err:
+            LOG.debug("Could not create temporary file in %s: %s", output_dir, err)
+            return False
+
+        try:
+            with open(tmp_fd, 'w', encoding='utf-8') as tmp_fh:
+                tmp_fh.write(content)
+                if file_stat is None:
+                    os.chmod(tmp_path, 0o666 & ~_get_umask())
+                else:
+                    os.chmod(tmp_path, stat.S_IMODE(file_stat.st_mode))
+                    tmp_stat = os.fstat(tmp_fh.fileno())
+                    if (tmp_stat.st_uid, tmp_stat.st_gid) != (file_stat.st_uid, file_stat.st_gid):
+                        os.chown(tmp_path, file_stat.st_uid, file_stat.st_gid)
+                if self.fsync == 'file':
+                    tmp_fh.flush()
+                    os.fsync(tmp_fh.fileno())
+            os.replace(tmp_path, output_file)
+        except (IOError, OSError, AttributeError) as err:
+            # AttributeError: os.chown is not available on all platforms.
+            LOG.debug("Could not replace %s atomically: %s", output_file, err)
+            os.unlink(tmp_path)
+            return False
+
+        if self.fsync == 'file':
+            _fsync_dir(output_dir)
+        return True
+
+    def merge(self, other):
+        """Take over the files pending synchronization of another instance, for example of a worker process."""
+        self.pending_paths.extend(other.pending_paths)
+        other.pending_paths = []
+
+    def sync(self):
+        """Synchronize the files written since the last call and their directories in ``batch`` mode."""
+        for output_file in self.pending_paths:
+            _fsync_path(output_file)
+        for output_dir in sorted(set(os.path.dirname(output_file) for output_file in self.pending_paths)):
+            _fsync_dir(output_dir)
+        self.pending_paths = []